@@ -0,0 +1,61 @@
+"""Compares the pandas groupby with the packed-key numpy aggregation
+
+Usage: python benchmarks/aggregate.py
+
+The data is synthetic but shaped like the cleaned sales data (about three
+million rows over 34 months, 60 shops and 22,170 items).
+"""
+# python standard library
+import timeit
+
+# from pypi
+import numpy
+import pandas
+
+# this project
+from kaggler.helpers.aggregate import dense_groups
+from kaggler.helpers.build_training_data import Grouper
+from kaggler.helpers.helpers import DataKeys
+
+ROWS = 2935849
+REPEAT = 3
+
+
+def synthetic_sales(rows=ROWS, seed=2018):
+    """makes a frame with the cleaned super-set's numeric columns
+
+    Args:
+     rows: how many rows to make
+     seed: random seed
+
+    Returns:
+     pandas.DataFrame: the fake sales
+    """
+    random = numpy.random.RandomState(seed)
+    return pandas.DataFrame({
+        DataKeys.date_block: random.randint(34, size=rows).astype(numpy.int8),
+        DataKeys.shop: random.randint(60, size=rows).astype(numpy.int8),
+        DataKeys.item: random.randint(22170, size=rows).astype(numpy.int16),
+        DataKeys.price: (random.rand(rows) * 1000).astype(numpy.float32),
+        DataKeys.day_count: random.randint(-1, 5, size=rows).astype(
+            numpy.float32),
+    })
+
+
+def best_time(function):
+    """the fastest of the runs in seconds"""
+    return min(timeit.repeat(function, number=1, repeat=REPEAT))
+
+
+if __name__ == "__main__":
+    sales = synthetic_sales()
+    keys = Grouper.keys
+    counts = sales[keys + [DataKeys.day_count]]
+    print("rows: {:,}".format(len(sales)))
+    for how, frame in (("sum", counts), ("last", sales)):
+        assert getattr(frame.groupby(keys), how)().equals(
+            dense_groups(frame, keys, how))
+        grouped = best_time(lambda: getattr(frame.groupby(keys), how)())
+        dense = best_time(lambda: dense_groups(frame, keys, how))
+        print("{}: pandas {:.3f} seconds, numpy {:.3f} seconds "
+              "({:.1f}x)".format(how, grouped, dense, grouped/dense))
@@ -0,0 +1,60 @@
+"""Compares the regex date-parser with the fixed-width one
+
+Usage: python benchmarks/dates.py [path to sales_train.csv.gz]
+
+Without a path it uses synthetic dates shaped like the sales data
+(about three million rows over a thousand distinct days).
+"""
+# python standard library
+import sys
+import timeit
+
+# from pypi
+import numpy
+import pandas
+
+# this project
+from kaggler.helpers.build_training_data import SuperDates
+from kaggler.helpers.dates import split_dates
+from kaggler.helpers.helpers import DataKeys
+
+ROWS = 2935849
+REPEAT = 3
+
+
+def synthetic_dates(rows=ROWS, seed=2018):
+    """makes dd.mm.yyyy strings for the days from 2013 through 2015
+
+    Args:
+     rows: how many dates to make
+     seed: random seed
+
+    Returns:
+     pandas.Series: the date strings
+    """
+    days = pandas.date_range("2013-01-01", "2015-10-31").strftime("%d.%m.%Y")
+    picks = numpy.random.RandomState(seed).randint(len(days), size=rows)
+    return pandas.Series(numpy.asarray(days)[picks], name=DataKeys.date)
+
+
+def best_time(function):
+    """the fastest of the runs in seconds"""
+    return min(timeit.repeat(function, number=1, repeat=REPEAT))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        dates = pandas.read_csv(sys.argv[1], usecols=[DataKeys.date])[
+            DataKeys.date]
+    else:
+        dates = synthetic_dates()
+    expression = SuperDates(cache=False).date_expression
+    regex = best_time(lambda: dates.str.extract(expression))
+    fixed = best_time(lambda: split_dates(dates))
+    extracted = dates.str.extract(expression).astype(int)
+    split = split_dates(dates)
+    assert (extracted.values == split.values).all()
+    print("rows: {:,}".format(len(dates)))
+    print("regex:       {:.3f} seconds".format(regex))
+    print("fixed-width: {:.3f} seconds".format(fixed))
+    print("speed-up:    {:.1f}x".format(regex/fixed))
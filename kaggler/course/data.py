@@ -6,10 +6,10 @@ import os
 
 # from pypi
 from dotenv import load_dotenv
-import pandas
 
 # this project
 from kaggler.errors import ConfigurationError
+from kaggler.helpers.helpers import DataTypes
 
 
 class Configuration:
@@ -148,7 +148,7 @@ class Data:
     def sales_training_data(self):
         """training data with the sales"""
         if self._sales_training_data is None:
-            self._sales_training_data = pandas.read_csv(
+            self._sales_training_data = DataTypes.read_csv(
                 self.paths.sales_training_data)
         return self._sales_training_data
 
@@ -156,35 +156,37 @@ class Data:
     def test_data(self):
         """The test-data set for submission"""
         if self._test_data is None:
-            self._test_data = pandas.read_csv(self.paths.test_data)
+            self._test_data = DataTypes.read_csv(self.paths.test_data)
         return self._test_data
 
     @property
     def product_categories(self):
         """supplemental product category data"""
-        if self._item_categories is None:
-            self._item_categories = pandas.read_csv(self.paths.item_categories)
-        return self._item_categories
+        if self._product_categories is None:
+            self._product_categories = DataTypes.read_csv(
+                self.paths.item_categories)
+        return self._product_categories
 
     @property
     def products(self):
         """extra information about the products"""
         if self._products is None:
-            self._products = pandas.read_csv(self.paths.items)
+            self._products = DataTypes.read_csv(self.paths.items)
         return self._products
 
     @property
     def shops(self):
         """extra data for the shops"""
         if self._shops is None:
-            self._shops = pandas.read_csv(self.paths.shops)
+            self._shops = DataTypes.read_csv(self.paths.shops)
         return self._shops
 
     @property
     def sample_submission(self):
         """an example of what you should submit"""
         if self._sample_submission is None:
-            self._sample_submission = pandas.read_csv(self.paths.sample_submission)
+            self._sample_submission = DataTypes.read_csv(
+                self.paths.sample_submission)
         return self._sample_submission
 
 if __name__ == "__main__":
@@ -0,0 +1,342 @@
+"""Ways to sum up the sales for each (month, shop, item)"""
+# python standard library
+from multiprocessing import Pool
+
+try:
+    from multiprocessing.shared_memory import SharedMemory
+except ImportError:
+    # python 3.7 and older (only the process pools need it)
+    SharedMemory = None
+
+# from pypi
+import numpy
+import pandas
+
+# this project
+from kaggler.errors import ConfigurationError
+from kaggler.helpers.helpers import DataKeys, DataTypes
+
+
+def combine_sums(partials, keys):
+    """merges partial sums that were grouped by the same keys
+
+    Args:
+     partials: data-frames indexed by the keys
+     keys: the names of the index levels
+
+    Returns:
+     pandas.DataFrame: one row per key with the summed values
+    """
+    return pandas.concat(partials).groupby(level=keys).sum()
+
+
+def streamed_sums(path, keys, columns, chunksize=10**6, combine_every=8):
+    """sums columns of a csv file for each key without loading all of it
+
+    The file is read ``chunksize`` rows at a time and each chunk is reduced
+    to its sums per key. The partial sums are merged every
+    ``combine_every`` chunks so only about one row per distinct key is kept
+    in memory no matter how big the file is.
+
+    Args:
+     path: path to the (possibly gzipped) csv file
+     keys: list of columns to group by
+     columns: list of columns to sum
+     chunksize: how many rows to read at a time
+     combine_every: how many partial sums to collect before merging them
+
+    Returns:
+     pandas.DataFrame: the sums indexed (and sorted) by the keys
+    """
+    partials = []
+    reader = pandas.read_csv(path, dtype=DataTypes.columns,
+                             usecols=keys + columns, chunksize=chunksize)
+    for chunk in reader:
+        partials.append(chunk.groupby(keys)[columns].sum())
+        if len(partials) >= combine_every:
+            partials = [combine_sums(partials, keys)]
+    if not partials:
+        raise ValueError("'{}' doesn't have any rows".format(path))
+    return combine_sums(partials, keys)
+
+
+def pack_keys(frame, keys, radixes=None):
+    """packs integer key-columns into one int64 key
+
+    Each column is shifted to start at zero and the columns are combined as
+    the digits of a mixed-radix number, so sorting the packed key sorts the
+    rows the same way sorting by the columns would.
+
+    Args:
+     frame: data-frame with integer key columns
+     keys: list of the columns to pack (most significant first)
+     radixes: (offset, size) for each key to use instead of the frame's
+      own (so the keys of two frames can be compared)
+
+    Returns:
+     tuple: packed keys, list of (offset, size) for each column
+
+    Raises:
+     ValueError: the key space doesn't fit in an int64
+    """
+    packed = numpy.zeros(len(frame), dtype=numpy.int64)
+    given = radixes
+    radixes = []
+    space = 1
+    for index, key in enumerate(keys):
+        values = frame[key].values.astype(numpy.int64)
+        if given is not None:
+            offset, size = given[index]
+        else:
+            offset = int(values.min()) if len(values) else 0
+            size = (int(values.max()) - offset + 1) if len(values) else 1
+        space *= size
+        if space >= 2**63:
+            raise ValueError("The keys are too sparse to pack into an int64")
+        packed = packed * size + (values - offset)
+        radixes.append((offset, size))
+    return packed, radixes
+
+
+def unpack_keys(packed, radixes):
+    """splits packed keys back into their columns
+
+    Args:
+     packed: the packed int64 keys
+     radixes: the (offset, size) list from ``pack_keys``
+
+    Returns:
+     list: arrays of the key values (in the original order)
+    """
+    columns = []
+    for offset, size in reversed(radixes):
+        columns.append(packed % size + offset)
+        packed = packed // size
+    return columns[::-1]
+
+
+def sorted_groups(packed, space=None):
+    """numbers the distinct packed keys with one sort
+
+    If the row numbers fit next to the keys in an int64, the row number is
+    appended to each key and the combined values are sorted directly
+    (which is much faster than a stable ``argsort``), otherwise it falls
+    back to a stable ``argsort``.
+
+    Args:
+     packed: non-negative int64 keys for each row
+     space: one more than the largest possible key (the max if None)
+
+    Returns:
+     tuple: sorted unique keys, group number of each row, row-index of
+      the last row in each group
+    """
+    rows = len(packed)
+    if space is None:
+        space = int(packed.max()) + 1 if rows else 1
+    width = max(rows, 1)
+    if space * width < 2**63:
+        combined = numpy.sort(packed * width + numpy.arange(rows))
+        order = combined % width
+        ordered = combined // width
+    else:
+        order = numpy.argsort(packed, kind="mergesort")
+        ordered = packed[order]
+    first = numpy.ones(rows, dtype=bool)
+    first[1:] = ordered[1:] != ordered[:-1]
+    inverse = numpy.empty(rows, dtype=numpy.int64)
+    inverse[order] = numpy.cumsum(first) - 1
+    last = numpy.ones(rows, dtype=bool)
+    last[:-1] = first[1:]
+    return ordered[first], inverse, order[last]
+
+
+def sum_dtype(dtype):
+    """the dtype pandas gives the sums of a column
+
+    Small integers are summed as int64 (uint64 if unsigned) so they can't
+    overflow and floats keep their own precision.
+
+    Args:
+     dtype: the column's dtype
+
+    Returns:
+     numpy.dtype: the dtype for the sums
+    """
+    if dtype.kind == "u":
+        return numpy.dtype(numpy.uint64)
+    if dtype.kind in "bi":
+        return numpy.dtype(numpy.int64)
+    return dtype
+
+
+def dense_groups(frame, keys, how="sum"):
+    """aggregates the frame by integer keys using numpy instead of groupby
+
+    The keys are packed into one int64 and a single stable sort of them
+    gives dense group numbers (and the last row of each group). The sums
+    come from ``numpy.bincount`` (so integer sums are exact up to 2**53)
+    and have the dtypes pandas would give them. Like pandas, the sums and
+    last values skip missing values.
+
+    Args:
+     frame: data-frame with integer keys and numeric values
+     keys: list of the columns to group by
+     how: "sum" or "last"
+
+    Returns:
+     pandas.DataFrame: the aggregated values indexed (and sorted) by the keys
+
+    Raises:
+     ValueError: unknown aggregation
+    """
+    if how not in ("sum", "last"):
+        raise ValueError("Unknown aggregation: '{}'".format(how))
+    packed, radixes = pack_keys(frame, keys)
+    space = numpy.prod([size for _, size in radixes], dtype=numpy.int64)
+    uniques, inverse, lasts = sorted_groups(packed, int(space))
+    aggregated = {}
+    for column in frame.columns:
+        if column in keys:
+            continue
+        values = frame[column].values
+        missing = pandas.isnull(values)
+        if how == "sum":
+            weights = numpy.where(missing, 0, values).astype(numpy.float64)
+            sums = numpy.bincount(inverse, weights=weights,
+                                  minlength=len(uniques))
+            if values.dtype.kind in "biu":
+                sums = numpy.rint(sums)
+            aggregated[column] = sums.astype(sum_dtype(values.dtype))
+        elif not missing.any():
+            aggregated[column] = values[lasts]
+        else:
+            rows = numpy.flatnonzero(~missing)
+            present = rows[sorted_groups(packed[rows], int(space))[2]]
+            filled = numpy.full(
+                len(uniques), numpy.nan,
+                dtype=values.dtype if values.dtype.kind == "f" else None)
+            filled[inverse[present]] = values[present]
+            aggregated[column] = filled
+    levels = [column.astype(frame[key].dtype)
+              for key, column in zip(keys, unpack_keys(uniques, radixes))]
+    if len(keys) == 1:
+        index = pandas.Index(levels[0], name=keys[0])
+    else:
+        index = pandas.MultiIndex.from_arrays(levels, names=keys)
+    return pandas.DataFrame(aggregated, index=index,
+                            columns=[column for column in frame.columns
+                                     if column not in keys])
+
+
+def grouped(frame, keys, how="sum", engine="pandas"):
+    """aggregates the frame by the keys
+
+    Args:
+     frame: data-frame to aggregate
+     keys: list of the columns to group by
+     how: name of the aggregation ("sum" or "last")
+     engine: "pandas" (groupby) or "numpy" (``dense_groups``)
+
+    Returns:
+     pandas.DataFrame: the aggregated values indexed by the keys
+
+    Raises:
+     ValueError: unknown engine
+    """
+    if engine == "numpy":
+        return dense_groups(frame, keys, how)
+    if engine == "pandas":
+        return getattr(frame.groupby(keys), how)()
+    raise ValueError("Unknown engine: '{}'".format(engine))
+
+
+def aggregate_shard(task):
+    """aggregates one shard of the columns held in shared memory
+
+    This is what the worker processes run for ``sharded_groups``.
+
+    Args:
+     task: tuple of (column specs, start, stop, keys, how, engine) where
+      the specs are (column, shared-memory name, dtype, length) tuples
+
+    Returns:
+     pandas.DataFrame: the shard aggregated by the keys
+    """
+    specs, start, stop, keys, how, engine = task
+    blocks = []
+    columns = {}
+    try:
+        for column, name, dtype, length in specs:
+            block = SharedMemory(name=name)
+            blocks.append(block)
+            values = numpy.ndarray(length, dtype=dtype, buffer=block.buf)
+            columns[column] = values[start:stop].copy()
+            # the view has to go before the block can be closed
+            del values
+    finally:
+        for block in blocks:
+            block.close()
+    return grouped(pandas.DataFrame(columns), keys, how, engine)
+
+
+def sharded_groups(frame, keys, how="sum", processes=None,
+                   shard=DataKeys.date_block, engine="pandas"):
+    """aggregates the frame one month at a time in a pool of processes
+
+    The columns are sorted (stably) by the shard column and copied once
+    into shared memory, so each worker only gets the offsets of its
+    month instead of a pickled copy of it. Since the shard column is one
+    of the keys, the concatenated shards are the same as a single groupby.
+
+    Args:
+     frame: data-frame with only numeric columns
+     keys: list of columns to group by (must include the shard column)
+     how: name of the groupby aggregation to use (e.g. "sum" or "last")
+     processes: number of worker processes (number of cores if None)
+     shard: column to split the work up on
+     engine: "pandas" or "numpy" (see ``grouped``)
+
+    Returns:
+     pandas.DataFrame: the aggregated frame indexed by the keys
+
+    Raises:
+     ValueError: the shard isn't a key or a column isn't numeric
+     ConfigurationError: there's no shared memory (python 3.7 or older)
+    """
+    if SharedMemory is None:
+        raise ConfigurationError(
+            "Grouping in processes needs multiprocessing.shared_memory "
+            "(python 3.8 or newer), leave processes unset")
+    if shard not in keys:
+        raise ValueError("The shard column '{}' needs to be one of the "
+                         "keys".format(shard))
+    for column, dtype in frame.dtypes.items():
+        if not pandas.api.types.is_numeric_dtype(dtype):
+            raise ValueError("Only numeric columns can be shared "
+                             "('{}' is {})".format(column, dtype))
+    order = numpy.argsort(frame[shard].values, kind="mergesort")
+    sharded = frame[shard].values[order]
+    starts = numpy.concatenate(
+        ([0], numpy.flatnonzero(numpy.diff(sharded)) + 1, [len(sharded)]))
+    blocks = []
+    try:
+        specs = []
+        for column in frame.columns:
+            values = frame[column].values
+            block = SharedMemory(create=True, size=max(values.nbytes, 1))
+            blocks.append(block)
+            shared = numpy.ndarray(len(values), dtype=values.dtype,
+                                   buffer=block.buf)
+            shared[:] = values[order]
+            del shared
+            specs.append((column, block.name, values.dtype.str, len(values)))
+        tasks = [(specs, start, stop, keys, how, engine)
+                 for start, stop in zip(starts[:-1], starts[1:])]
+        with Pool(processes) as pool:
+            shards = pool.map(aggregate_shard, tasks)
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    return pandas.concat(shards)
@@ -4,6 +4,7 @@ import warnings
 warnings.filterwarnings("ignore", message="numpy.dtype size changed")
 warnings.filterwarnings("ignore", message="numpy.ufunc size changed")
 
+import numpy
 import pandas
 from sklearn.model_selection import train_test_split
 
@@ -11,8 +12,21 @@ from kaggler.helpers.helpers import (
     DataKeys,
     DataNames,
     DataSource,
+    DataTypes,
     Helpers,
 )
+from kaggler.helpers.aggregate import (
+    grouped,
+    sharded_groups,
+    streamed_sums,
+)
+from kaggler.helpers.dates import split_dates
+from kaggler.helpers.features import lag_features, window_features
+from kaggler.helpers.grid import month_grid
+from kaggler.helpers.stage_cache import (
+    Digest,
+    StageCache,
+)
 
 class Pickles:
     """Holder of the pickle names"""
@@ -24,13 +38,266 @@ class Pickles:
     y_test = "y_test"
     train_test = "train_test"
 
-class SuperSet:
-    """Creates the super-set of data"""
-    def __init__(self):
-        self._data_sources = None
+def replace_months(data, new):
+    """puts new months into the data
+
+    Rows in ``data`` for any month that is in ``new`` are dropped, then the
+    new rows are added and everything is sorted by month, shop and item, so
+    ``new`` has to have all the rows for its months (see ``in_months``).
+
+    Args:
+     data: data-frame with a date_block_num column
+     new: data-frame with the same columns for the new months
+
+    Returns:
+     pandas.DataFrame: the data with the new months
+    """
+    kept = data[~data[DataKeys.date_block].isin(
+        new[DataKeys.date_block].unique())]
+    combined = pandas.concat((kept, new[data.columns]), ignore_index=True)
+    combined = combined.sort_values(
+        [DataKeys.date_block, DataKeys.shop, DataKeys.item],
+        kind="mergesort")
+    return combined.reset_index(drop=True)
+
+
+def in_months(data, months):
+    """the rows of some months
+
+    Args:
+     data: data-frame with a date_block_num column
+     months: the months (date_block_num) to keep
+
+    Returns:
+     pandas.DataFrame: the rows for the months
+    """
+    return data[data[DataKeys.date_block].isin(months)]
+
+
+class StageGraph:
+    """Registry that shares stages between the stages downstream of them
+
+    Without this each stage builds its own copy of everything upstream of
+    it (e.g. ``Chunked`` and ``SuperGroup`` would each load and clean the
+    sales data). The graph hands out one stage per class and parameters
+    and drops a stage's data once every stage that uses it has its own.
+
+    Args:
+     cache: whether the stages use the on-disk stage cache
+    """
+    def __init__(self, cache=True):
+        self.cache = cache
+        self.stages = {}
+        self.finished = set()
+        return
+
+    def stage(self, stage_class, **parameters):
+        """gets the shared stage
+
+        Parameters that are None are left out (None means the stage's
+        default) so they don't make a second copy of the same stage.
+
+        Args:
+         stage_class: the Stage sub-class to get
+         parameters: keyword arguments for the stage
+
+        Returns:
+         Stage: the one stage in this graph for the class and parameters
+        """
+        parameters = {name: value for name, value in parameters.items()
+                      if value is not None}
+        key = (stage_class, tuple(sorted(
+            (name, tuple(value) if isinstance(value, list) else value)
+            for name, value in parameters.items())))
+        if key not in self.stages:
+            self.stages[key] = stage_class(cache=self.cache, graph=self,
+                                           **parameters)
+        return self.stages[key]
+
+    def add(self, stage):
+        """registers a stage that was created outside of the graph
+
+        Args:
+         stage: the stage to add
+        """
+        self.stages.setdefault((type(stage), id(stage)), stage)
+        return
+
+    def discover(self, stage):
+        """registers everything upstream of the stage
+
+        Args:
+         stage: the stage to walk up from
+        """
+        for upstream in stage.upstream:
+            self.discover(upstream)
+        return
+
+    def release(self, stage):
+        """drops upstream data that no other stage still needs
+
+        Args:
+         stage: a stage whose data was just created
+        """
+        self.finished.add(stage)
+        for upstream in stage.upstream:
+            dependents = [other for other in list(self.stages.values())
+                          if upstream in other.upstream]
+            if all(dependent in self.finished for dependent in dependents):
+                upstream.clear()
+        return
+
+    def reset_keys(self):
+        """makes every stage work out its key again (after its inputs change)"""
+        for stage in self.stages.values():
+            stage._key = None
+        return
+
+
+class Stage:
+    """Base for the stages that build the training data
+
+    The data for a stage is cached on disk under a hash of its inputs and
+    parameters so a new process only rebuilds what's downstream of a change.
+    The key starts with the stage's slot (its parameters and those of the
+    stages upstream of it, without the input files) so saving a stage only
+    replaces the pickle it supersedes, not the stage's other variants.
+    Stages that are cheap to re-make from their upstream data set
+    ``persist`` to False so they don't store another copy of it.
+
+    Args:
+     cache: whether to use the on-disk stage cache
+     graph: stage-graph to share the upstream stages with
+    """
+    version = 2
+    persist = True
+
+    def __init__(self, cache=True, graph=None):
+        self.cache = cache
+        self.graph = graph
+        if self.graph is None:
+            self.graph = StageGraph(cache)
+            self.graph.add(self)
+        self._stage_cache = None
+        self._slot = None
+        self._key = None
         self._data = None
         return
 
+    @property
+    def name(self):
+        """the name to store the stage under"""
+        return type(self).__name__
+
+    @property
+    def stage_cache(self):
+        """the on-disk cache for the stages"""
+        if self._stage_cache is None:
+            self._stage_cache = StageCache()
+        return self._stage_cache
+
+    @property
+    def parameters(self):
+        """the settings that change the output of this stage"""
+        return ()
+
+    @property
+    def inputs(self):
+        """hashes of the files this stage reads"""
+        return ()
+
+    @property
+    def upstream(self):
+        """the stages this stage gets its data from"""
+        return ()
+
+    @property
+    def slot(self):
+        """hash of this stage's parameters and its upstream slots"""
+        if self._slot is None:
+            self._slot = Digest.parts(
+                self.name, self.version, self.parameters,
+                tuple(stage.slot for stage in self.upstream))
+        return self._slot
+
+    @property
+    def key(self):
+        """the slot and a hash of this stage's inputs and its upstream keys"""
+        if self._key is None:
+            self._key = "{}-{}".format(self.slot, Digest.parts(
+                self.inputs, tuple(stage.key for stage in self.upstream)))
+        return self._key
+
+    def build(self):
+        """creates the data for this stage"""
+        raise NotImplementedError("Stages need to implement build")
+
+    def clear(self):
+        """drops the in-memory data (it gets re-loaded if it's asked for)"""
+        self._data = None
+        return
+
+    def update(self, data):
+        """replaces the data (e.g. after new sales were added to it)
+
+        The data is stored in the stage cache under the stage's current key
+        so the next process loads it instead of building it again.
+
+        Args:
+         data: the new data for this stage
+        """
+        self._data = data
+        if self.cache and self.persist:
+            self.stage_cache.save(self.name, self.key, data)
+        return
+
+    @property
+    def data(self):
+        """the data for this stage"""
+        if self._data is None:
+            self.graph.discover(self)
+            if self.cache and self.persist:
+                self._data = self.stage_cache.fetch(self.name, self.key,
+                                                    self.build)
+            else:
+                self._data = self.build()
+            self.graph.release(self)
+        return self._data
+
+
+def kept_columns(columns, drop, needed=()):
+    """the columns to load when some will be dropped later
+
+    Args:
+     columns: all the columns in the file
+     drop: the columns that get dropped (load everything if None)
+     needed: columns to load even if they get dropped (e.g. merge keys)
+
+    Returns:
+     list: the columns to load (None to load all of them)
+    """
+    if drop is None:
+        return None
+    return [column for column in columns
+            if column not in drop or column in needed]
+
+
+class SuperSet(Stage):
+    """Creates the super-set of data
+
+    Args:
+     columns: the columns to load (all of them if None)
+     cache: whether to use the on-disk stage cache
+     graph: stage-graph to share the upstream stages with
+    """
+    all_columns = [DataKeys.date, DataKeys.date_block, DataKeys.shop,
+                   DataKeys.item, DataKeys.price, DataKeys.day_count]
+    def __init__(self, columns=None, cache=True, graph=None):
+        super().__init__(cache, graph)
+        self.columns = columns
+        self._data_sources = None
+        return
+
     @property
     def data_sources(self):
         """string-values for the data sources"""
@@ -40,17 +307,98 @@ class SuperSet:
         return self._data_sources
 
     @property
-    def data(self):
+    def path(self):
+        """path to the sales data"""
+        return self.data_sources.file_name_paths[DataNames.training]
+
+    @property
+    def parameters(self):
+        """the columns to load"""
+        return None if self.columns is None else tuple(self.columns)
+
+    @property
+    def inputs(self):
+        """hash of the sales file"""
+        return (Digest.file(self.path),)
+
+    def build(self):
         """the super-set"""
+        return DataTypes.read_csv(self.path, self.columns)
+
+
+class SalesDeltas(Stage):
+    """The sales that were appended after the sales file
+
+    The appended sales are kept in the stage cache under the hash of the
+    sales file (a new sales file starts without any) and their hashes are
+    part of this stage's key, so everything downstream of the cleaned data
+    gets a new key once sales are appended.
+
+    Args:
+     cache: whether to use the on-disk stage cache
+     graph: stage-graph to share the upstream stages with
+    """
+    def __init__(self, cache=True, graph=None):
+        super().__init__(cache, graph)
+        return
+
+    @property
+    def storage_key(self):
+        """hash of the sales file the sales were appended to"""
+        return "{}-{}".format(self.slot, Digest.parts(self.inputs))
+
+    @property
+    def inputs(self):
+        """hash of the sales file"""
+        return (Digest.file(self.graph.stage(SuperSet).path),)
+
+    @property
+    def key(self):
+        """the slot and a hash of the sales file and the appended sales"""
+        if self._key is None:
+            self._key = "{}-{}".format(self.slot, Digest.parts(
+                self.inputs,
+                tuple(Digest.frame(sales) for sales in self.data)))
+        return self._key
+
+    @property
+    def data(self):
+        """list of the appended sales data-frames (oldest first)"""
         if self._data is None:
-            self._data = pandas.read_csv(
-                self.data_sources.file_name_paths[DataNames.training])
+            stored = (self.stage_cache.load(self.name, self.storage_key)
+                      if self.cache else None)
+            self._data = stored or []
         return self._data
 
-class Items:
-    """sale items data"""
-    def __init__(self):
-        self._data = None
+    def clear(self):
+        """keeps the appended sales (the key is made from them)"""
+        return
+
+    def add(self, sales):
+        """appends sales and makes the stages in the graph get new keys
+
+        Args:
+         sales: data-frame of the new sales with the sales_train columns
+        """
+        self._data = self.data + [sales]
+        if self.cache:
+            self.stage_cache.save(self.name, self.storage_key, self._data)
+        self.graph.reset_keys()
+        return
+
+
+class Items(Stage):
+    """sale items data
+
+    Args:
+     columns: the columns to load (all of them if None)
+     cache: whether to use the on-disk stage cache
+     graph: stage-graph to share the upstream stages with
+    """
+    all_columns = [DataKeys.name, DataKeys.item, DataKeys.item_category]
+    def __init__(self, columns=None, cache=True, graph=None):
+        super().__init__(cache, graph)
+        self.columns = columns
         self._data_sources = None
         return
 
@@ -60,73 +408,147 @@ class Items:
         if self._data_sources is None:
             self._data_sources = DataSource()
         return self._data_sources
-        
+
     @property
-    def data(self):
+    def path(self):
+        """path to the items data"""
+        return self.data_sources.file_name_paths[DataNames.items]
+
+    @property
+    def parameters(self):
+        """the columns to load"""
+        return None if self.columns is None else tuple(self.columns)
+
+    @property
+    def inputs(self):
+        """hash of the items file"""
+        return (Digest.file(self.path),)
+
+    def build(self):
         """dataframe of sale items"""
-        if self._data is None:
-            self._data = pandas.read_csv(
-                self.data_sources.file_name_paths[DataNames.items])
-        return self._data
+        return DataTypes.read_csv(self.path, self.columns)
 
 
-class SuperDuper:
-    """super set with item counts"""
-    def __init__(self):
-        self._data = None
-        self._super_set = None
-        self._items = None
+class SuperDuper(Stage):
+    """super set with item counts
+
+    Args:
+     drop: columns that get dropped downstream (so they aren't loaded)
+     cache: whether to use the on-disk stage cache
+     graph: stage-graph to share the upstream stages with
+    """
+    # a merge of the sales and items so it isn't stored on disk
+    persist = False
+
+    def __init__(self, drop=None, cache=True, graph=None):
+        super().__init__(cache, graph)
+        self.drop = drop
         return
 
+    @property
+    def super_set_stage(self):
+        """the stage that loads the super-set
+
+        The date is loaded as long as any of its parts are kept.
+        """
+        needed = [DataKeys.item]
+        if self.drop is not None and not set(
+                (DataKeys.day, DataKeys.month, DataKeys.year)) <= set(
+                    self.drop):
+            needed.append(DataKeys.date)
+        return self.graph.stage(
+            SuperSet,
+            columns=kept_columns(SuperSet.all_columns, self.drop, needed))
+
+    @property
+    def items_stage(self):
+        """the stage that loads the sale-items"""
+        return self.graph.stage(
+            Items, columns=kept_columns(Items.all_columns, self.drop,
+                                        [DataKeys.item]))
+
+    @property
+    def upstream(self):
+        """super-set and items stages"""
+        return (self.super_set_stage, self.items_stage)
+
     @property
     def super_set(self):
         """super-set of data"""
-        if self._super_set is None:
-            self._super_set = SuperSet().data
-        return self._super_set
+        return self.super_set_stage.data
 
     @property
     def items(self):
         """sale-items data"""
-        if self._items is None:
-            self._items = Items().data
-        return self._items
+        return self.items_stage.data
 
-    @property
-    def data(self):
+    def transform(self, sales):
+        """adds the sale-items to sales data
+
+        Args:
+         sales: data-frame with the sales_train columns
+
+        Returns:
+         pandas.DataFrame: the sales with the item columns
+        """
+        data = sales.merge(self.items,
+                           on=DataKeys.item,
+                           how="left")
+        assert len(data) == len(sales)
+        return data
+
+    def build(self):
         """super set with sale items"""
-        if self._data is None:
-            self._data = self.super_set.merge(self.items,
-                                              on=DataKeys.item,
-                                              how="left")
-        
-            assert len(self.data) == len(self.super_set)
-        return self._data
+        return self.transform(self.super_set)
+
 
+class SuperDates(Stage):
+    """Super-set with dates split out
+
+    Args:
+     fast: decode the unique dates to integers instead of using the regex
+     drop: columns that get dropped downstream (so they aren't loaded)
+     cache: whether to use the on-disk stage cache
+     graph: stage-graph to share the upstream stages with
+    """
+    # quick to split from its upstream so it isn't stored on disk
+    persist = False
 
-class SuperDates:
-    """Super-set with dates split out"""
-    def __init__(self):
-        self._super_duper = None
+    def __init__(self, fast=True, drop=None, cache=True, graph=None):
+        super().__init__(cache, graph)
+        self.fast = fast
+        self.drop = drop
         self._date_expression = None
         self._dates = None
-        self._data = None
         return
 
+    @property
+    def parameters(self):
+        """which date-parser to use"""
+        return (self.fast,)
+
+    @property
+    def super_duper_stage(self):
+        """the stage that adds the items to the super-set"""
+        return self.graph.stage(SuperDuper, drop=self.drop)
+
+    @property
+    def upstream(self):
+        """the super-duper stage"""
+        return (self.super_duper_stage,)
+
     @property
     def super_duper(self):
         """A super-duper data set"""
-        if self._super_duper is None:
-            self._super_duper = SuperDuper().data
-        return self._super_duper
+        return self.super_duper_stage.data
 
     @property
     def date_expression(self):
         """regular expression to parse the dates"""
         if self._date_expression is None:
             self._date_expression = (r'(?P<{}>\d{{2}})\.'
-                                     '(?P<{}>\d{{2}})\.'
-                                     '(?P<{}>\d{{4}})').format(
+                                     r'(?P<{}>\d{{2}})\.'
+                                     r'(?P<{}>\d{{4}})').format(
                                          DataKeys.day,
                                          DataKeys.month,
                                          DataKeys.year)
@@ -136,61 +558,168 @@ class SuperDates:
     def dates(self):
         """dataframe of dates"""
         if self._dates is None:
-            self._dates = self.super_duper.date.str.extract(
-                self.date_expression)
+            self._dates = self.split(self.super_duper)
         return self._dates
 
-    @property
-    def data(self):
+    def split(self, frame):
+        """splits the date column into day, month and year
+
+        Args:
+         frame: data-frame with a date column
+
+        Returns:
+         pandas.DataFrame: the day, month and year columns (none if the
+          frame doesn't have the date)
+        """
+        if DataKeys.date not in frame.columns:
+            return pandas.DataFrame(index=frame.index)
+        if self.fast:
+            return split_dates(frame[DataKeys.date])
+        return frame[DataKeys.date].str.extract(self.date_expression)
+
+    def transform(self, frame):
+        """adds the date columns to the frame
+
+        Args:
+         frame: data-frame with a date column
+
+        Returns:
+         pandas.DataFrame: the frame with the date-part columns added
+        """
+        return pandas.concat((frame, self.split(frame)), axis='columns')
+
+    def build(self):
         """data set with date columns"""
-        if self._data is None:
-            self._data = pandas.concat(
-                (self.super_duper, self.dates),
-                axis='columns')
-        return self._data
+        return pandas.concat(
+            (self.super_duper, self.dates),
+            axis='columns')
+
+    def clear(self):
+        """drops the data and the dates"""
+        super().clear()
+        self._dates = None
+        return
+
 
-class SuperClean:
-    """The super-set data with extra columns removed"""
-    def __init__(self, drop=[DataKeys.date, DataKeys.name, DataKeys.day]):
+class SuperClean(Stage):
+    """The super-set data with extra columns removed
+
+    Args:
+     drop: columns to remove
+     cache: whether to use the on-disk stage cache
+     graph: stage-graph to share the upstream stages with
+    """
+    def __init__(self, drop=[DataKeys.date, DataKeys.name, DataKeys.day],
+                 cache=True, graph=None):
+        super().__init__(cache, graph)
         self.drop = drop
-        self._super_set = None
-        self._data = None
         return
 
+    @property
+    def super_set_stage(self):
+        """the stage that adds the dates (loading only the kept columns)"""
+        return self.graph.stage(SuperDates, drop=self.drop)
+
+    @property
+    def parameters(self):
+        """the columns to drop"""
+        return tuple(self.drop)
+
+    @property
+    def deltas_stage(self):
+        """the stage with the appended sales"""
+        return self.graph.stage(SalesDeltas)
+
+    @property
+    def upstream(self):
+        """the super-dates and appended-sales stages"""
+        return (self.super_set_stage, self.deltas_stage)
+
     @property
     def super_set(self):
         """the super-set data"""
-        if self._super_set is None:
-            self._super_set = SuperDates().data
-        return self._super_set
+        return self.super_set_stage.data
 
-    @property
-    def data(self):
-        """The cleaned data"""
-        if self._data is None:
-            self._data = self.super_set.drop(self.drop, axis="columns")
-        return self._data
+    def transform(self, frame):
+        """drops the extra columns
+
+        Args:
+         frame: data-frame with the super-dates columns
+
+        Returns:
+         pandas.DataFrame: the frame without the dropped columns
+        """
+        return frame.drop(self.drop, axis="columns", errors="ignore")
+
+    def clean(self, sales):
+        """runs new sales through the super-duper, dates and clean steps
+
+        Args:
+         sales: data-frame with the sales_train columns
+
+        Returns:
+         pandas.DataFrame: the sales cleaned the same way as the super-set
+        """
+        dates = self.super_set_stage
+        return self.transform(
+            dates.transform(dates.super_duper_stage.transform(
+                DataTypes.convert(sales))))
+
+    def build(self):
+        """The cleaned data with any appended sales at the end"""
+        cleaned = self.transform(self.super_set)
+        appended = [self.clean(sales)[cleaned.columns]
+                    for sales in self.deltas_stage.data]
+        if not appended:
+            return cleaned
+        return pandas.concat([cleaned] + appended, ignore_index=True)
+
+    def save(self, columnar=False):
+        """Saves the data as a pickle
 
-    def save(self):
-        """Saves the data as a pickle"""
-        Helpers.pickle_it(self.data, Pickles.super_set)
+        Args:
+         columnar: save it as a parquet file instead of a pickle
+        """
+        save = Helpers.parquet_it if columnar else Helpers.pickle_it
+        save(self.data, Pickles.super_set)
         return
 
 
-class Grouper:
-    """Data Grouped by month, shop, item"""
-    def __init__(self):
-        self._cleaned = None
+class Grouper(Stage):
+    """Data Grouped by month, shop, item
+
+    Args:
+     chunksize: if set, stream the sales file this many rows at a time
+     processes: if set, sum the months in this many processes
+     engine: "pandas" (groupby) or "numpy" (packed-key bincount)
+     cache: whether to use the on-disk stage cache
+     graph: stage-graph to share the upstream stages with
+    """
+    keys = [DataKeys.date_block, DataKeys.shop, DataKeys.item]
+
+    def __init__(self, chunksize=None, processes=None, engine="pandas",
+                 cache=True, graph=None):
+        super().__init__(cache, graph)
+        self.chunksize = chunksize
+        self.processes = processes
+        self.engine = engine
         self._grouper = None
-        self._data = None
         return
 
+    @property
+    def cleaned_stage(self):
+        """the stage that cleans the super-set"""
+        return self.graph.stage(SuperClean)
+
+    @property
+    def upstream(self):
+        """the super-clean stage"""
+        return (self.cleaned_stage,)
+
     @property
     def cleaned(self):
         """cleaned super-set"""
-        if self._cleaned is None:
-            self._cleaned = SuperClean().data
-        return self._cleaned
+        return self.cleaned_stage.data
 
     @property
     def grouper(self):
@@ -201,134 +730,521 @@ class Grouper:
                                           DataKeys.day_count]].copy()
         return self._grouper
 
-    @property
-    def data(self):
-        """the summed group-data"""
-        if self._data is None:
-            self._data = self.grouper.groupby([DataKeys.date_block,
-                                               DataKeys.shop,
-                                               DataKeys.item]).sum()
-        return self._data
+    def build(self):
+        """the summed group-data
 
+        With a chunksize the sums are streamed from the sales file instead
+        of the cleaned super-set (the result is the same, but only the
+        partial sums are kept in memory). With processes each month is
+        summed in its own worker.
+        """
+        if self.chunksize is not None:
+            sums = streamed_sums(self.graph.stage(SuperSet).path,
+                                 self.keys, [DataKeys.day_count],
+                                 chunksize=self.chunksize)
+            for sales in self.cleaned_stage.deltas_stage.data:
+                sums = self.merge(sums, self.transform(
+                    self.cleaned_stage.clean(sales)))
+            return sums
+        if self.processes is not None:
+            return sharded_groups(self.grouper, self.keys, "sum",
+                                  self.processes, engine=self.engine)
+        return self.transform(self.cleaned)
 
-class Chunked:
-    """Data set chunked-up to the months"""
-    def __init__(self):
-        self._grouped = None
-        self._data = None
+    def transform(self, cleaned):
+        """sums the day-counts of cleaned data in this process
+
+        Args:
+         cleaned: data-frame with the super-clean columns
+
+        Returns:
+         pandas.DataFrame: the counts summed by month, shop and item
+        """
+        return grouped(cleaned[self.keys + [DataKeys.day_count]],
+                       self.keys, "sum", self.engine)
+
+    def merge(self, data, new):
+        """adds new sums to the grouped data
+
+        The months in the new sums are summed again with the rows that are
+        already there, so a partial month adds to its earlier counts.
+
+        Args:
+         data: data-frame like this stage's data
+         new: the new sales summed with ``transform``
+
+        Returns:
+         pandas.DataFrame: the grouped data with the new counts added
+        """
+        touched = data.index.get_level_values(DataKeys.date_block).isin(
+            new.index.get_level_values(DataKeys.date_block).unique())
+        summed = grouped(pandas.concat((data[touched], new)).reset_index(),
+                         self.keys, "sum", self.engine)
+        return pandas.concat((data[~touched], summed)).sort_index()
+
+    def clear(self):
+        """drops the data and the grouping columns"""
+        super().clear()
+        self._grouper = None
         return
 
+
+class Chunked(Stage):
+    """Data set chunked-up to the months
+
+    Args:
+     chunksize: if set, the grouper streams the sales this many rows at a time
+     processes: if set, the grouper sums the months in this many processes
+     engine: "pandas" or "numpy" aggregation for the grouper
+     cache: whether to use the on-disk stage cache
+     graph: stage-graph to share the upstream stages with
+    """
+    # just the grouper's frame with its index reset so it isn't stored on disk
+    persist = False
+
+    def __init__(self, chunksize=None, processes=None, engine=None,
+                 cache=True, graph=None):
+        super().__init__(cache, graph)
+        self.chunksize = chunksize
+        self.processes = processes
+        self.engine = engine
+        return
+
+    @property
+    def grouped_stage(self):
+        """the stage that groups the months"""
+        return self.graph.stage(Grouper, chunksize=self.chunksize,
+                                processes=self.processes, engine=self.engine)
+
+    @property
+    def upstream(self):
+        """the grouper stage"""
+        return (self.grouped_stage,)
+
     @property
     def grouped(self):
         """grouped data"""
-        if self._grouped is None:
-            self._grouped = Grouper().data
-        return self._grouped
+        return self.grouped_stage.data
 
-    @property
-    def data(self):
+    def transform(self, grouped):
+        """moves the keys out of the index and renames the counts
+
+        Args:
+         grouped: data-frame like the grouper's data
+
+        Returns:
+         pandas.DataFrame: the chunked version of the grouped data
+        """
+        data = grouped.reset_index()
+        data.rename(
+            columns={DataKeys.day_count: DataKeys.month_count},
+            inplace=True)
+        return data
+
+    def build(self):
         """The chunked data with the counts renamed"""
-        if self._data is None:
-            self._data =  self.grouped.reset_index()
-            self._data.rename(
-                columns={DataKeys.day_count: DataKeys.month_count},
-                inplace=True)
-        return self._data
+        return self.transform(self.grouped)
+
+    def append(self, sales):
+        """adds new sales to the chunked data
+
+        Only the new rows are cleaned and summed. Their counts are added to
+        any that are already there for the same month, shop and item. The
+        sales are kept (``SalesDeltas``) and the grouper's data is stored
+        under its new key so the stages downstream use the new counts.
+
+        Args:
+         sales: data-frame of the new sales with the sales_train columns
+
+        Returns:
+         pandas.DataFrame: the chunked rows for the new sales' months
+        """
+        grouper = self.grouped_stage
+        cleaned = grouper.cleaned_stage.clean(sales)
+        summed = grouper.merge(grouper.data, grouper.transform(cleaned))
+        grouper.cleaned_stage.deltas_stage.add(sales)
+        grouper.update(summed)
+        self.update(self.transform(summed))
+        return in_months(self.data, cleaned[DataKeys.date_block].unique())
+
 
-class SuperGroup:
+class SuperGroup(Stage):
     """Super Set grouped
 
     Args:
      groups: list of columns to form the groups
+     processes: if set, group the months in this many processes
+     engine: "pandas" (groupby) or "numpy" (packed-key sort)
+     cache: whether to use the on-disk stage cache
+     graph: stage-graph to share the upstream stages with
     """
     def __init__(self, groups=[DataKeys.date_block,
                                DataKeys.shop,
-                               DataKeys.item]):
+                               DataKeys.item],
+                 processes=None, engine="pandas", cache=True, graph=None):
+        super().__init__(cache, graph)
         self.groups = groups
-        self._super_set = None
-        self._data = None
+        self.processes = processes
+        self.engine = engine
         return
 
+    @property
+    def super_set_stage(self):
+        """the stage that cleans the super-set"""
+        return self.graph.stage(SuperClean)
+
+    @property
+    def parameters(self):
+        """the columns to group"""
+        return tuple(self.groups)
+
+    @property
+    def upstream(self):
+        """the super-clean stage"""
+        return (self.super_set_stage,)
+
     @property
     def super_set(self):
         """cleaned super set of data"""
-        if self._super_set is None:
-            self._super_set = SuperClean().data
-        return self._super_set
+        return self.super_set_stage.data
 
-    @property
-    def data(self):
+    def build(self):
         """the super group data"""
-        if self._data is None:
-            self._data = self.super_set.groupby(self.groups).last()
-            self._data = self._data.reset_index()
-        return self._data
+        if self.processes is None:
+            return self.transform(self.super_set)
+        data = sharded_groups(self.super_set, self.groups, "last",
+                              self.processes, engine=self.engine)
+        return data.reset_index()
 
-class MergeChunked:
-    """merge the super-set and the chunked data"""
-    def __init__(self):
-        self._chunked = None
-        self._super_group = None
-        self._data = None
+    def transform(self, cleaned):
+        """takes the last values for each group in this process
+
+        Args:
+         cleaned: data-frame with the super-clean columns
+
+        Returns:
+         pandas.DataFrame: the last values with the groups as columns
+        """
+        return grouped(cleaned, self.groups, "last",
+                       self.engine).reset_index()
+
+    def merge(self, data, new):
+        """adds new last values to the grouped data
+
+        The months in the new values are grouped again with the rows that
+        are already there (the new values are last).
+
+        Args:
+         data: data-frame like this stage's data
+         new: the new sales grouped with ``transform``
+
+        Returns:
+         pandas.DataFrame: the grouped data with the new values
+        """
+        if DataKeys.date_block in self.groups:
+            touched = data[DataKeys.date_block].isin(
+                new[DataKeys.date_block].unique())
+        else:
+            touched = numpy.ones(len(data), dtype=bool)
+        regrouped = self.transform(
+            pandas.concat((data[touched], new[data.columns]),
+                          ignore_index=True))
+        merged = pandas.concat((data[~touched], regrouped[data.columns]),
+                               ignore_index=True)
+        return merged.sort_values(self.groups,
+                                  kind="mergesort").reset_index(drop=True)
+
+
+class Grid(Stage):
+    """Every (month, shop, item) combination with its monthly count
+
+    For each month, every shop with sales is paired with every item sold
+    that month and the counts are filled in from the chunked data (0 if
+    there weren't any sales).
+
+    Args:
+     cache: whether to use the on-disk stage cache
+     graph: stage-graph to share the upstream stages with
+    """
+    def __init__(self, cache=True, graph=None):
+        super().__init__(cache, graph)
         return
 
+    @property
+    def chunked_stage(self):
+        """the stage with the monthly counts"""
+        return self.graph.stage(Chunked)
+
+    @property
+    def upstream(self):
+        """the chunked stage"""
+        return (self.chunked_stage,)
+
     @property
     def chunked(self):
-        if self._chunked is None:
-            self._chunked = Chunked().data
-        return self._chunked
+        """the monthly counts"""
+        return self.chunked_stage.data
+
+    def build(self):
+        """the grid with the monthly counts"""
+        return month_grid(self.chunked)
+
+
+class LagFeatures(Stage):
+    """The grid with the monthly counts of earlier months for each shop-item
+
+    Args:
+     lags: how many months back to look for each feature
+     cache: whether to use the on-disk stage cache
+     graph: stage-graph to share the upstream stages with
+    """
+    def __init__(self, lags=[1, 2, 3, 6, 12], cache=True, graph=None):
+        super().__init__(cache, graph)
+        self.lags = lags
+        return
 
     @property
-    def super_group(self):
-        if self._super_group is None:
-            self._super_group = SuperGroup().data
-        return self._super_group
+    def grid_stage(self):
+        """the stage with the grid"""
+        return self.graph.stage(Grid)
 
     @property
-    def data(self):
-        if self._data is None:
-            self._data = self.chunked.merge(self.super_group,
-                        on=[DataKeys.date_block,
-                            DataKeys.shop,
-                            DataKeys.item],
-                        how="left")
-            self._data.drop([DataKeys.day_count], axis="columns")
-        return self._data
+    def parameters(self):
+        """the lags"""
+        return tuple(self.lags)
+
+    @property
+    def upstream(self):
+        """the grid stage"""
+        return (self.grid_stage,)
+
+    @property
+    def grid(self):
+        """the grid of monthly counts"""
+        return self.grid_stage.data
+
+    def build(self):
+        """the grid with the lag columns added"""
+        return pandas.concat((self.grid, lag_features(self.grid, self.lags)),
+                             axis="columns")
+
+
+class MergeChunked(Stage):
+    """merge the super-set and the chunked data
+
+    Args:
+     processes: if set, group the months in this many processes
+     engine: "pandas" or "numpy" aggregation for the groups
+     cache: whether to use the on-disk stage cache
+     graph: stage-graph to share the upstream stages with
+    """
+    def __init__(self, processes=None, engine=None, cache=True, graph=None):
+        super().__init__(cache, graph)
+        self.processes = processes
+        self.engine = engine
+        return
+
+    @property
+    def chunked_stage(self):
+        """the stage with the monthly counts"""
+        return self.graph.stage(Chunked, processes=self.processes,
+                                engine=self.engine)
+
+    @property
+    def super_group_stage(self):
+        """the stage with the last values for each month"""
+        return self.graph.stage(SuperGroup, processes=self.processes,
+                                engine=self.engine)
+
+    @property
+    def upstream(self):
+        """the chunked and super-group stages"""
+        return (self.chunked_stage, self.super_group_stage)
+
+    @property
+    def chunked(self):
+        return self.chunked_stage.data
+
+    @property
+    def super_group(self):
+        return self.super_group_stage.data
+
+    def transform(self, chunked, super_group):
+        """merges chunked data with super-group data
+
+        Args:
+         chunked: data-frame like the chunked data
+         super_group: data-frame like the super-group data
+
+        Returns:
+         pandas.DataFrame: the merged data
+        """
+        data = chunked.merge(super_group,
+                             on=[DataKeys.date_block,
+                                 DataKeys.shop,
+                                 DataKeys.item],
+                             how="left")
+        data.drop([DataKeys.day_count], axis="columns")
+        return data
+
+    def build(self):
+        return self.transform(self.chunked, self.super_group)
+
+    def append(self, sales, columnar=False):
+        """adds new sales to the merged data and saves it
+
+        Only the new rows are cleaned and grouped. They're added to the
+        months that are already there (counts are summed, the other columns
+        take the last value) and only those months are merged again. The
+        sales are kept (``SalesDeltas``) and the upstream and merged data
+        are stored under their new keys, so the stages downstream (and
+        ``TrainValidation``) see the new sales. The grouped pickle
+        (``Pickles.grouped``) is saved again.
+
+        Args:
+         sales: data-frame of the new sales with the sales_train columns
+         columnar: save the grouped data as a parquet file instead of a pickle
+
+        Returns:
+         pandas.DataFrame: the merged rows for the new sales' months
+        """
+        chunker = self.chunked_stage
+        grouper = chunker.grouped_stage
+        super_group = self.super_group_stage
+        cleaned = grouper.cleaned_stage.clean(sales)
+        months = cleaned[DataKeys.date_block].unique()
+        existing = self.data
+        summed = grouper.merge(grouper.data, grouper.transform(cleaned))
+        groups = super_group.merge(super_group.data,
+                                   super_group.transform(cleaned))
+        chunked = chunker.transform(summed)
+        new = self.transform(in_months(chunked, months),
+                             in_months(groups, months))
+        grouper.cleaned_stage.deltas_stage.add(sales)
+        grouper.update(summed)
+        chunker.update(chunked)
+        super_group.update(groups)
+        self.update(replace_months(existing, new))
+        self(columnar)
+        return new
+
+    def __call__(self, columnar=False):
+        """save the data as a pickle
+
+        Args:
+         columnar: save it as a parquet file instead of a pickle
+        """
+        save = Helpers.parquet_it if columnar else Helpers.pickle_it
+        save(self.data, Pickles.grouped)
+        return
+
+
 
-    def __call__(self):
-        """save the data as a pickle"""
-        Helpers.pickle_it(self.data, Pickles.grouped)
+
+class WindowFeatures(Stage):
+    """The merged monthly data with rolling statistics of the earlier months
+
+    The statistics are of the monthly totals for each item, shop and item
+    category (see ``window_features``).
+
+    Args:
+     windows: how many earlier months each feature looks at
+     keys: the columns to total the months by
+     cache: whether to use the on-disk stage cache
+     graph: stage-graph to share the upstream stages with
+    """
+    def __init__(self, windows=[3, 6, 12],
+                 keys=[DataKeys.item, DataKeys.shop, DataKeys.item_category],
+                 cache=True, graph=None):
+        super().__init__(cache, graph)
+        self.windows = windows
+        self.keys = keys
         return
 
+    @property
+    def merged_stage(self):
+        """the stage with the merged monthly data"""
+        return self.graph.stage(MergeChunked)
+
+    @property
+    def parameters(self):
+        """the windows and keys"""
+        return tuple(self.windows), tuple(self.keys)
+
+    @property
+    def upstream(self):
+        """the merged stage"""
+        return (self.merged_stage,)
+
+    @property
+    def merged(self):
+        """the monthly counts with the item categories"""
+        return self.merged_stage.data
 
+    def build(self):
+        """the merged data with the window columns added"""
+        return pandas.concat(
+            (self.merged, window_features(self.merged, self.keys,
+                                          self.windows)),
+            axis="columns")
 
 
 class TrainValidation:
     """Makes the training and validation sets
 
+    By default the rows are shuffled into the sets (``train_test_split``)
+    but with ``by_month`` the earlier months are used to train and a later
+    month to validate, so there's no peeking at the future. The month
+    splits are slices of the month-sorted data so they don't copy it.
+
     Args:
      test_size: fraction of data to use as validaiton data
      seed: random seed
+     cache: whether to use the on-disk stage cache
+     processes: if set, group the months in this many processes
+     engine: "pandas" or "numpy" aggregation for the groups
+     by_month: split on the months instead of at random
+     validation_month: the month to validate on (the last one if None)
     """
-    def __init__(self, test_size=0.2, seed=2018):
+    def __init__(self, test_size=0.2, seed=2018, cache=True,
+                 processes=None, engine=None, by_month=False,
+                 validation_month=None):
         self.test_size = test_size
         self.seed = seed
-        self._target = None
-        self._features = None
-        self._chunked = None
-        self._x_train = None
-        self._x_test = None
-        self._y_train = None
-        self._y_test = None
+        self.cache = cache
+        self.processes = processes
+        self.engine = engine
+        self.by_month = by_month
+        self.validation_month = validation_month
+        self._merged_stage = None
+        self.reset()
         return
 
+    @property
+    def merged_stage(self):
+        """the stage with the merged monthly data"""
+        if self._merged_stage is None:
+            self._merged_stage = MergeChunked(processes=self.processes,
+                                              engine=self.engine,
+                                              cache=self.cache)
+        return self._merged_stage
+
     @property
     def chunked(self):
-        """the data chunked by month"""
+        """the data chunked by month (sorted by the month)"""
         if self._chunked is None:
-            self._chunked = MergeChunked().data
+            chunked = self.merged_stage.data
+            if not chunked[DataKeys.date_block].is_monotonic_increasing:
+                chunked = chunked.sort_values(DataKeys.date_block,
+                                              kind="mergesort")
+            self._chunked = chunked
         return self._chunked
 
+    @property
+    def months(self):
+        """the (sorted) month of each row"""
+        return self.chunked[DataKeys.date_block].values
+
     @property
     def target(self):
         """the target data"""
@@ -370,7 +1286,52 @@ class TrainValidation:
             self.split()
         return self._y_test
 
+    def month_split(self, month):
+        """splits the data into the months before a month and the month
+
+        Args:
+         month: the month (date_block_num) to validate on
+
+        Returns:
+         tuple: x-train, x-test, y-train, y-test (slices, not copies)
+
+        Raises:
+         ValueError: there's no data for the month
+        """
+        start, stop = numpy.searchsorted(self.months, [month, month + 1])
+        if start == stop:
+            raise ValueError("There's no data for month {}".format(month))
+        return (self.features.iloc[:start], self.features.iloc[start:stop],
+                self.target.iloc[:start], self.target.iloc[start:stop])
+
+    def rolling_splits(self, months=None, folds=3):
+        """month splits with the validation month moving forward
+
+        Each fold trains on all the months before its validation month
+        (rolling-origin cross-validation).
+
+        Args:
+         months: the months to validate on (the last ``folds`` if None)
+         folds: how many of the last months to use if months isn't given
+
+        Yields:
+         tuple: x-train, x-test, y-train, y-test for each month
+        """
+        if months is None:
+            last = int(self.months[-1])
+            months = range(last - folds + 1, last + 1)
+        for month in months:
+            yield self.month_split(month)
+
     def split(self):
+        """sets the training and validation sets"""
+        if self.by_month:
+            month = (self.validation_month
+                     if self.validation_month is not None
+                     else int(self.months[-1]))
+            (self._x_train, self._x_test,
+             self._y_train, self._y_test) = self.month_split(month)
+            return
         self._x_train, self._x_test, self._y_train, self._y_test = train_test_split(
             self.features,
             self.target,
@@ -379,12 +1340,50 @@ class TrainValidation:
         )
         return
 
-    def __call__(self):
-        """stores the data-files"""
-        Helpers.pickle_it(self.x_train, Pickles.x_train)
-        Helpers.pickle_it(self.x_test, Pickles.x_test)
-        Helpers.pickle_it(self.y_train, Pickles.y_train)
-        Helpers.pickle_it(self.y_test, Pickles.y_test)
+    def reset(self):
+        """drops the data and the splits so they're made again"""
+        self._target = None
+        self._features = None
+        self._chunked = None
+        self._x_train = None
+        self._x_test = None
+        self._y_train = None
+        self._y_test = None
+        return
+
+    def append(self, sales, columnar=False, mapped=False):
+        """adds new sales and stores the data-files made with them
+
+        Args:
+         sales: data-frame of the new sales with the sales_train columns
+         columnar: save them as parquet files instead of pickles
+         mapped: save them as memory-mappable numpy files instead of pickles
+
+        Returns:
+         pandas.DataFrame: the merged rows for the new sales' months
+        """
+        new = self.merged_stage.append(sales, columnar)
+        self.reset()
+        self(columnar, mapped)
+        return new
+
+    def __call__(self, columnar=False, mapped=False):
+        """stores the data-files
+
+        Args:
+         columnar: save them as parquet files instead of pickles
+         mapped: save them as memory-mappable numpy files instead of pickles
+        """
+        if mapped:
+            save = Helpers.map_it
+        elif columnar:
+            save = Helpers.parquet_it
+        else:
+            save = Helpers.pickle_it
+        save(self.x_train, Pickles.x_train)
+        save(self.x_test, Pickles.x_test)
+        save(self.y_train, Pickles.y_train)
+        save(self.y_test, Pickles.y_test)
         return
 
     def check(self):
@@ -0,0 +1,70 @@
+"""Helpers to pull the parts out of the sales dates"""
+# from pypi
+import numpy
+import pandas
+
+# this project
+from kaggler.helpers.helpers import DataKeys
+
+
+class DateFormat:
+    """Layout of the fixed-width ``dd.mm.yyyy`` dates"""
+    width = 10
+    separators = (2, 5)
+    day = slice(0, 2)
+    month = slice(3, 5)
+    year = slice(6, 10)
+
+
+def digits_to_integer(digits):
+    """converts columns of single digits to an integer
+
+    Args:
+     digits: 2-D array of digit values (most significant column first)
+
+    Returns:
+     numpy.ndarray: the integers the digits spell out
+    """
+    value = numpy.zeros(len(digits), dtype=numpy.int16)
+    for column in range(digits.shape[1]):
+        value = value * 10 + digits[:, column]
+    return value
+
+
+def split_dates(dates):
+    """splits ``dd.mm.yyyy`` strings into day, month and year
+
+    Only the unique dates (about a thousand in the sales data) are decoded,
+    by slicing their fixed-width bytes, and the results are then copied to
+    the rows with the factorized codes.
+
+    Args:
+     dates: series of date-strings (or a categorical of them)
+
+    Returns:
+     pandas.DataFrame: int8 day and month and int16 year columns
+
+    Raises:
+     ValueError: a date is missing or isn't in the dd.mm.yyyy format
+    """
+    codes, uniques = pandas.factorize(dates)
+    if (codes < 0).any():
+        raise ValueError("Missing dates can't be split")
+    text = numpy.asarray(uniques, dtype="U")
+    if (numpy.char.str_len(text) != DateFormat.width).any():
+        raise ValueError("Dates need to be formatted dd.mm.yyyy")
+    raw = numpy.char.encode(text, "ascii")
+    characters = raw.view(numpy.uint8).reshape(len(raw), DateFormat.width)
+    digits = characters.astype(numpy.int16) - ord("0")
+    separators = list(DateFormat.separators)
+    numbers = numpy.delete(digits, separators, axis=1)
+    if ((characters[:, separators] != ord(".")).any()
+            or (numbers < 0).any() or (numbers > 9).any()):
+        raise ValueError("Dates need to be formatted dd.mm.yyyy")
+    day = digits_to_integer(digits[:, DateFormat.day]).astype(numpy.int8)
+    month = digits_to_integer(digits[:, DateFormat.month]).astype(numpy.int8)
+    year = digits_to_integer(digits[:, DateFormat.year])
+    return pandas.DataFrame({DataKeys.day: day[codes],
+                             DataKeys.month: month[codes],
+                             DataKeys.year: year[codes]},
+                            index=getattr(dates, "index", None))
@@ -0,0 +1,308 @@
+"""Mean (target) encoders for categorical columns"""
+# from pypi
+import numpy
+import pandas
+
+
+class MeanEncoder:
+    """Base for the encoders that map categories to their target means
+
+    The sub-classes make the (regularized) encodings of the training data
+    in ``fit_transform`` and keep the totals for each category so that
+    ``transform`` can encode other data with all of the training data.
+
+    Args:
+     columns: list of the columns to encode
+     smoothing: weight (alpha) of the global mean (0 means no smoothing)
+     global_mean: mean to smooth toward and fill in for unseen categories
+      (the target's mean if None)
+     suffix: what to add to the column names for the encoded columns
+    """
+    def __init__(self, columns, smoothing=0, global_mean=None,
+                 suffix="_mean_target"):
+        self.columns = columns
+        self.smoothing = smoothing
+        self.global_mean = global_mean
+        self.suffix = suffix
+        self.prior = None
+        self.categories = {}
+        self.sums = {}
+        self.counts = {}
+        return
+
+    def fit_prior(self, target):
+        """sets the mean to smooth toward
+
+        Args:
+         target: the target values as float64
+        """
+        self.prior = (target.mean() if self.global_mean is None
+                      else self.global_mean)
+        return
+
+    def fit_column(self, frame, column, target):
+        """sets the per-category totals for one column
+
+        The columns are fit one at a time so only one column's codes are
+        in memory at once.
+
+        Args:
+         frame: data-frame with the column to encode
+         column: name of the column
+         target: the target values as float64
+
+        Returns:
+         numpy.ndarray: the category code for each row
+
+        Raises:
+         ValueError: the column has missing values
+        """
+        codes, categories = pandas.factorize(frame[column])
+        if (codes < 0).any():
+            raise ValueError("'{}' has missing values".format(column))
+        self.categories[column] = pandas.Index(categories)
+        self.sums[column] = numpy.bincount(
+            codes, weights=target,
+            minlength=len(categories)).astype(numpy.float64, copy=False)
+        self.counts[column] = numpy.bincount(
+            codes, minlength=len(categories)).astype(numpy.float64)
+        return codes
+
+    def fit(self, frame, target):
+        """sets the prior and the per-category totals
+
+        Args:
+         frame: data-frame with the columns to encode
+         target: the target values as float64
+
+        Raises:
+         ValueError: one of the columns has missing values
+        """
+        self.fit_prior(target)
+        for column in self.columns:
+            self.fit_column(frame, column, target)
+        return
+
+    def encode(self, sums, counts):
+        """the (smoothed) means with the global mean where there's no data
+
+        The work is done in place so the only new array is the float32
+        result (the sums and counts are overwritten).
+
+        Args:
+         sums: float64 target sums for each row's category
+         counts: float64 row counts for each row's category
+
+        Returns:
+         numpy.ndarray: float32 encodings
+        """
+        empty = counts <= 0
+        sums += self.prior * self.smoothing
+        counts += self.smoothing
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            numpy.divide(sums, counts, out=sums)
+        sums[empty] = self.prior
+        return sums.astype(numpy.float32)
+
+    def fit_transform(self, frame, target):
+        """encodes the training data"""
+        raise NotImplementedError("Encoders need to implement fit_transform")
+
+    def transform(self, frame):
+        """encodes new data with the means of all the training data
+
+        Args:
+         frame: data-frame with the columns to encode
+
+        Returns:
+         pandas.DataFrame: the encoded columns (with the suffix)
+        """
+        if self.prior is None:
+            raise RuntimeError("Call fit_transform before transform")
+        encoded = {}
+        for column in self.columns:
+            codes = self.categories[column].get_indexer(frame[column])
+            seen = codes >= 0
+            sums = numpy.where(seen, self.sums[column][codes], 0.0)
+            counts = numpy.where(seen, self.counts[column][codes], 0.0)
+            encoded[column + self.suffix] = self.encode(sums, counts)
+        return pandas.DataFrame(encoded, index=frame.index)
+
+
+class OutOfFoldEncoder(MeanEncoder):
+    """Encodes columns with the target-mean of the other folds
+
+    This gives the same encodings as looping over ``KFold(folds)`` and
+    mapping each validation fold to the training folds' means, but the
+    per-fold sums and counts are computed once for each column (with one
+    ``numpy.bincount``) and each fold's out-of-fold values are the totals
+    minus that fold's own sums and counts.
+
+    Args:
+     columns: list of the columns to encode
+     folds: number of (unshuffled) folds or an array with the fold of each row
+     smoothing: weight (alpha) of the global mean (0 means no smoothing)
+     global_mean: mean to smooth toward and fill in for unseen categories
+      (the target's mean if None)
+     suffix: what to add to the column names for the encoded columns
+    """
+    def __init__(self, columns, folds=5, smoothing=0, global_mean=None,
+                 suffix="_mean_target"):
+        super().__init__(columns, smoothing, global_mean, suffix)
+        self.folds = folds
+        return
+
+    def fold_ids(self, rows):
+        """the fold for each row
+
+        With a number of folds the rows are split into contiguous folds the
+        same way sklearn's (unshuffled) KFold splits them.
+
+        Args:
+         rows: the number of rows
+
+        Returns:
+         numpy.ndarray: fold number for each row
+        """
+        if not numpy.isscalar(self.folds):
+            folds = numpy.asarray(self.folds)
+            if len(folds) != rows:
+                raise ValueError("Need one fold per row ({} != {})".format(
+                    len(folds), rows))
+            return pandas.factorize(folds)[0]
+        sizes = numpy.full(self.folds, rows // self.folds, dtype=numpy.int64)
+        sizes[:rows % self.folds] += 1
+        return numpy.repeat(numpy.arange(self.folds), sizes)
+
+    def fit_transform(self, frame, target):
+        """out-of-fold encodings for the training data
+
+        This also keeps the totals for each category so ``transform`` can
+        encode other data (e.g. the validation set) with all of the
+        training data.
+
+        Args:
+         frame: data-frame with the columns to encode
+         target: the target values (same length as frame)
+
+        Returns:
+         pandas.DataFrame: the encoded columns (with the suffix)
+        """
+        target = numpy.asarray(target, dtype=numpy.float64)
+        self.fit_prior(target)
+        folds = self.fold_ids(len(frame))
+        fold_count = folds.max() + 1 if len(folds) else 0
+        encoded = {}
+        for column in self.columns:
+            codes = self.fit_column(frame, column, target)
+            size = len(self.categories[column])
+            cells = folds * size + codes
+            fold_sums = numpy.bincount(cells, weights=target,
+                                       minlength=fold_count * size)
+            fold_counts = numpy.bincount(cells, minlength=fold_count * size)
+            encoded[column + self.suffix] = self.encode(
+                self.sums[column][codes] - fold_sums[cells],
+                self.counts[column][codes] - fold_counts[cells])
+        return pandas.DataFrame(encoded, index=frame.index)
+
+
+class LeaveOneOutEncoder(MeanEncoder):
+    """Encodes each row with the target-mean of the other rows in its category
+
+    Each row's encoding is its category's total minus its own target,
+    divided by the category's count minus one (rows alone in their
+    category get the global mean). The per-category totals are computed
+    once per column and the rows are filled in with two scratch arrays
+    that are re-used for every column.
+
+    Args:
+     columns: list of the columns to encode
+     smoothing: weight (alpha) of the global mean (0 means no smoothing)
+     global_mean: mean to smooth toward and fill in for unseen categories
+      (the target's mean if None)
+     suffix: what to add to the column names for the encoded columns
+    """
+    def fit_transform(self, frame, target):
+        """leave-one-out encodings for the training data
+
+        Args:
+         frame: data-frame with the columns to encode
+         target: the target values (same length as frame)
+
+        Returns:
+         pandas.DataFrame: the encoded columns (with the suffix)
+        """
+        target = numpy.asarray(target, dtype=numpy.float64)
+        self.fit_prior(target)
+        sums = numpy.empty(len(frame))
+        counts = numpy.empty(len(frame))
+        encoded = {}
+        for column in self.columns:
+            codes = self.fit_column(frame, column, target)
+            numpy.take(self.sums[column], codes, out=sums)
+            sums -= target
+            numpy.take(self.counts[column], codes, out=counts)
+            counts -= 1
+            encoded[column + self.suffix] = self.encode(sums, counts)
+        return pandas.DataFrame(encoded, index=frame.index)
+
+
+class ExpandingMeanEncoder(MeanEncoder):
+    """Encodes each row with the target-mean of the earlier rows in its category
+
+    The rows should be in time order. For each column the rows are
+    stable-sorted by category once and a single cumulative sum over the
+    sorted targets (with the sum at the start of each category taken
+    off) gives the sums and counts of the earlier rows. Rows that are the
+    first in their category get the global mean. The columns are done one
+    at a time in scratch arrays that are re-used for every column, so
+    each column only adds its float32 encodings (and its sort order while
+    it's being encoded).
+
+    Args:
+     columns: list of the columns to encode
+     smoothing: weight (alpha) of the global mean (0 means no smoothing)
+     global_mean: mean to smooth toward and fill in for unseen categories
+      (the target's mean if None)
+     suffix: what to add to the column names for the encoded columns
+    """
+    def fit_transform(self, frame, target):
+        """expanding-mean encodings for the training data
+
+        Args:
+         frame: data-frame with the columns to encode (in time order)
+         target: the target values (same length as frame)
+
+        Returns:
+         pandas.DataFrame: the encoded columns (with the suffix)
+        """
+        target = numpy.asarray(target, dtype=numpy.float64)
+        self.fit_prior(target)
+        rows = len(frame)
+        positions = numpy.arange(rows)
+        sums = numpy.empty(rows)
+        counts = numpy.empty(rows)
+        running = numpy.empty(rows)
+        starts = numpy.empty(rows, dtype=numpy.intp)
+        first = numpy.ones(rows, dtype=bool)
+        encoded = {}
+        for column in self.columns:
+            codes = self.fit_column(frame, column, target)
+            order = numpy.argsort(codes, kind="mergesort")
+            # the sorted codes mark where each category starts
+            numpy.take(codes, order, out=starts)
+            del codes
+            numpy.not_equal(starts[1:], starts[:-1], out=first[1:])
+            numpy.multiply(positions, first, out=starts)
+            numpy.maximum.accumulate(starts, out=starts)
+            # the sums of the earlier targets in the category
+            numpy.take(target, order, out=sums)
+            numpy.cumsum(sums, out=running)
+            running -= sums
+            numpy.take(running, starts, out=sums)
+            running -= sums
+            sums[order] = running
+            numpy.subtract(positions, starts, out=running)
+            counts[order] = running
+            encoded[column + self.suffix] = self.encode(sums, counts)
+        return pandas.DataFrame(encoded, index=frame.index)
@@ -0,0 +1,171 @@
+"""Features made from the earlier months of the monthly data"""
+# from pypi
+import numpy
+import pandas
+
+# this project
+from kaggler.helpers.aggregate import pack_keys
+from kaggler.helpers.helpers import DataKeys
+
+
+def lag_features(frame, lags=(1, 2, 3, 6, 12), target=DataKeys.month_count,
+                 groups=[DataKeys.shop, DataKeys.item],
+                 time=DataKeys.date_block, fill_value=0):
+    """the target from earlier months for each group
+
+    The rows are packed into (groups..., month) keys and sorted once. Since
+    the month is the last digit of the packed key, the key for the same
+    group ``lag`` months earlier is just the key minus the lag, so each lag
+    is a ``searchsorted`` into the sorted keys (no merges).
+
+    Args:
+     frame: monthly data (e.g. the grid or the chunked data)
+     lags: how many months back to look for each feature
+     target: the column to lag
+     groups: the columns that identify a series (e.g. shop and item)
+     time: the month column
+     fill_value: what to use when the group has no row for the earlier month
+
+    Returns:
+     pandas.DataFrame: float32 ``<target>_lag_<lag>`` columns (same index
+      as the frame)
+    """
+    packed, radixes = pack_keys(frame, groups + [time])
+    time_offset, _ = radixes[-1]
+    months = frame[time].values.astype(numpy.int64)
+    order = numpy.argsort(packed, kind="mergesort")
+    ordered = packed[order]
+    values = frame[target].values[order]
+    lagged = {}
+    for lag in lags:
+        wanted = packed - lag
+        positions = numpy.searchsorted(ordered, wanted)
+        positions[positions == len(ordered)] = 0
+        found = (ordered[positions] == wanted) & (months - lag >= time_offset)
+        column = numpy.full(len(frame), fill_value, dtype=numpy.float32)
+        column[found] = values[positions[found]]
+        lagged["{}_lag_{}".format(target, lag)] = column
+    return pandas.DataFrame(lagged, index=frame.index)
+
+
+def rolling_means(totals, window):
+    """mean of the previous ``window`` months for every key and month
+
+    Args:
+     totals: (keys x months) matrix of monthly totals
+     window: how many earlier months to average
+
+    Returns:
+     numpy.ndarray: (keys x months) means (0 where there's no history)
+    """
+    months = totals.shape[1]
+    cumulative = numpy.zeros((totals.shape[0], months + 1))
+    numpy.cumsum(totals, axis=1, out=cumulative[:, 1:])
+    now = numpy.arange(months)
+    start = numpy.maximum(now - window, 0)
+    counts = (now - start).astype(numpy.float64)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        means = (cumulative[:, now] - cumulative[:, start]) / counts
+    means[:, counts == 0] = 0
+    return means
+
+
+def rolling_maxes(totals, window):
+    """largest total of the previous ``window`` months for every key and month
+
+    Args:
+     totals: (keys x months) matrix of monthly totals
+     window: how many earlier months to look at
+
+    Returns:
+     numpy.ndarray: (keys x months) maxes (0 where there's no history)
+    """
+    maxes = numpy.full(totals.shape, -numpy.inf)
+    for shift in range(1, min(window, totals.shape[1] - 1) + 1):
+        numpy.maximum(maxes[:, shift:], totals[:, :-shift],
+                      out=maxes[:, shift:])
+    maxes[:, 0] = 0
+    return maxes
+
+
+def exponential_means(totals, window):
+    """exponentially weighted mean of the earlier months
+
+    The smoothing factor comes from the window the same way pandas gets it
+    from a span (2/(window + 1)). The first month with history starts at
+    the previous month's total and each later month blends in the month
+    before it, one (vectorized) step per month.
+
+    Args:
+     totals: (keys x months) matrix of monthly totals
+     window: the span of the weighting
+
+    Returns:
+     numpy.ndarray: (keys x months) means (0 where there's no history)
+    """
+    alpha = 2 / (window + 1)
+    means = numpy.zeros(totals.shape)
+    if totals.shape[1] > 1:
+        means[:, 1] = totals[:, 0]
+    for month in range(2, totals.shape[1]):
+        means[:, month] = (alpha * totals[:, month - 1]
+                           + (1 - alpha) * means[:, month - 1])
+    return means
+
+
+class WindowStatistics:
+    """The statistics that ``window_features`` knows about"""
+    mean = "mean"
+    max = "max"
+    ewm = "ewm"
+    functions = {mean: rolling_means,
+                 max: rolling_maxes,
+                 ewm: exponential_means}
+
+
+def window_features(frame, keys=[DataKeys.item, DataKeys.shop,
+                                 DataKeys.item_category],
+                    windows=(3, 6, 12),
+                    statistics=(WindowStatistics.mean,
+                                WindowStatistics.max,
+                                WindowStatistics.ewm),
+                    target=DataKeys.month_count, time=DataKeys.date_block):
+    """rolling statistics of the earlier months for each key
+
+    For each key (e.g. item) the rows' targets are summed into a dense
+    (key x month) matrix with one ``numpy.bincount`` (months without rows
+    are 0). Every window and statistic is then computed on that matrix for
+    all the keys at once and copied back to the rows with the same cell
+    index. Only months before a row's month are used so there's no
+    leakage from the month being predicted.
+
+    Args:
+     frame: monthly data with the key, target and month columns
+     keys: the columns to group the totals by
+     windows: how many earlier months each feature looks at
+     statistics: names from ``WindowStatistics``
+     target: the column to total
+     time: the month column
+
+    Returns:
+     pandas.DataFrame: float32 ``<key>_<statistic>_<window>`` columns
+      (same index as the frame)
+    """
+    months = frame[time].values.astype(numpy.int64)
+    months = months - (months.min() if len(months) else 0)
+    span = int(months.max()) + 1 if len(months) else 1
+    values = frame[target].values.astype(numpy.float64)
+    features = {}
+    for key in keys:
+        codes, categories = pandas.factorize(frame[key])
+        cells = codes * span + months
+        totals = numpy.bincount(
+            cells, weights=values,
+            minlength=len(categories) * span).reshape(len(categories), span)
+        for statistic in statistics:
+            function = WindowStatistics.functions[statistic]
+            for window in windows:
+                table = function(totals, window)
+                features["{}_{}_{}".format(key, statistic, window)] = (
+                    table.ravel()[cells].astype(numpy.float32))
+    return pandas.DataFrame(features, index=frame.index)
@@ -0,0 +1,64 @@
+"""Builds the grid of every (month, shop, item) that could have had sales"""
+# from pypi
+import numpy
+import pandas
+
+# this project
+from kaggler.helpers.aggregate import pack_keys
+from kaggler.helpers.helpers import DataKeys, DataTypes
+
+
+def month_grid(chunked, target=DataKeys.month_count):
+    """makes the cartesian product of the shops and items for each month
+
+    Every shop that sold something in a month is paired with every item
+    that was sold in that month (by any shop). The products are made with
+    ``numpy.repeat`` and ``numpy.tile`` into pre-allocated compact arrays,
+    and since the grid and the chunked data are both sorted by (month,
+    shop, item) the targets are filled in with a ``searchsorted`` on their
+    packed keys instead of a merge. Combinations without sales get 0.
+
+    Args:
+     chunked: data-frame with the month, shop, item and target columns
+     target: the column with the monthly counts
+
+    Returns:
+     pandas.DataFrame: the grid sorted by month, shop and item
+    """
+    keys = [DataKeys.date_block, DataKeys.shop, DataKeys.item]
+    months = chunked[DataKeys.date_block].values
+    shops = chunked[DataKeys.shop].values
+    items = chunked[DataKeys.item].values
+    blocks = numpy.unique(months)
+    shops_in = [numpy.unique(shops[months == block]) for block in blocks]
+    items_in = [numpy.unique(items[months == block]) for block in blocks]
+    sizes = [len(block_shops) * len(block_items)
+             for block_shops, block_items in zip(shops_in, items_in)]
+    total = sum(sizes)
+    columns = {
+        DataKeys.date_block: numpy.empty(
+            total, dtype=DataTypes.columns[DataKeys.date_block]),
+        DataKeys.shop: numpy.empty(total,
+                                   dtype=DataTypes.columns[DataKeys.shop]),
+        DataKeys.item: numpy.empty(total,
+                                   dtype=DataTypes.columns[DataKeys.item]),
+    }
+    start = 0
+    for block, block_shops, block_items, size in zip(blocks, shops_in,
+                                                     items_in, sizes):
+        stop = start + size
+        columns[DataKeys.date_block][start:stop] = block
+        columns[DataKeys.shop][start:stop] = numpy.repeat(block_shops,
+                                                          len(block_items))
+        columns[DataKeys.item][start:stop] = numpy.tile(block_items,
+                                                        len(block_shops))
+        start = stop
+    grid = pandas.DataFrame(columns, columns=keys)
+    counts, radixes = pack_keys(chunked, keys)
+    cells, _ = pack_keys(grid, keys, radixes)
+    order = numpy.argsort(counts, kind="mergesort")
+    targets = numpy.zeros(total, dtype=DataTypes.columns[DataKeys.month_count])
+    targets[numpy.searchsorted(cells, counts[order])] = chunked[
+        target].values[order]
+    grid[target] = targets
+    return grid
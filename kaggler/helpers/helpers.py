@@ -1,14 +1,32 @@
 # python standard library
+import json
 import os
 import pickle
 # from pypi
 from tabulate import tabulate
+import numpy
+import pandas
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# this project
+from kaggler.errors import ConfigurationError
 
 
 class Helpers:
     """Helper functions"""
     pickle_target = os.path.expanduser("~/projects/kaggle-competitions/pickles/")
     pickle_target_string = pickle_target + "{}.pkl"
+    parquet_target_string = pickle_target + "{}.parquet"
+    parquet_compression = "zstd"
+    series_metadata = b"kaggler.series"
+    mapped_target_string = pickle_target + "{}.npy"
+    mapped_index_string = pickle_target + "{}.index.npy"
+    mapped_metadata_string = pickle_target + "{}.json"
 
     @staticmethod
     def print_head(frame, showindex=False):
@@ -76,6 +94,164 @@ class Helpers:
         """
         return os.path.isfile(Helpers.pickle_target_string.format(name))
 
+    @staticmethod
+    def parquet_it(thing, name, compression=None):
+        """save the data-frame or series as a parquet file in the data folder
+
+        Unlike a pickle, the columns are stored (and compressed) separately
+        so they can be loaded on their own.
+
+        Args:
+         thing: pandas data-frame or series to save
+         name: thing to call the file
+         compression: codec or dict of column: codec (default zstd)
+        """
+        if pyarrow is None:
+            raise ConfigurationError(
+                "pyarrow is needed for parquet files (pip install pyarrow)")
+        compression = (compression if compression is not None
+                       else Helpers.parquet_compression)
+        series = isinstance(thing, pandas.Series)
+        frame = thing.to_frame() if series else thing
+        table = pyarrow.Table.from_pandas(frame)
+        if series:
+            metadata = dict(table.schema.metadata or {})
+            metadata[Helpers.series_metadata] = str(thing.name).encode("utf-8")
+            table = table.replace_schema_metadata(metadata)
+        pyarrow.parquet.write_table(table,
+                                    Helpers.parquet_target_string.format(name),
+                                    compression=compression)
+        return
+
+    @staticmethod
+    def unparquet(name, columns=None, date_blocks=None):
+        """loads the parquet file from the data folder
+
+        Args:
+         name: name of the file without the folder or extension
+         columns: the columns to load (all if None)
+         date_blocks: the months (date_block_num) to keep (all if None)
+
+        Returns:
+         pandas.DataFrame or pandas.Series: what was saved
+        """
+        if pyarrow is None:
+            raise ConfigurationError(
+                "pyarrow is needed for parquet files (pip install pyarrow)")
+        filters = (None if date_blocks is None
+                   else [(DataKeys.date_block, "in", list(date_blocks))])
+        table = pyarrow.parquet.read_pandas(
+            Helpers.parquet_target_string.format(name),
+            columns=columns, filters=filters)
+        frame = table.to_pandas()
+        metadata = table.schema.metadata or {}
+        if Helpers.series_metadata in metadata:
+            return frame[frame.columns[0]]
+        return frame
+
+    @staticmethod
+    def parquet_exists(name):
+        """checks if the thing is already a parquet file
+
+        Args:
+         name: name of the file without folder or extension
+
+        Returns:
+         bool: True if the parquet file exists
+        """
+        return os.path.isfile(Helpers.parquet_target_string.format(name))
+
+    @staticmethod
+    def map_it(thing, name):
+        """save the data-frame or series as a numpy file that can be memory-mapped
+
+        All the columns are stored in one (column-major) matrix with a dtype
+        they can all be cast to, so processes that load it with ``unmap``
+        share the same read-only pages instead of each getting a copy. The
+        original dtypes go in the json file so ``unmap`` can restore them.
+
+        Args:
+         thing: pandas data-frame or series to save
+         name: thing to call the file
+
+        Raises:
+         ValueError: a column isn't a numpy bool, integer or float
+        """
+        series = isinstance(thing, pandas.Series)
+        dtypes = [thing.dtype] if series else list(thing.dtypes)
+        labels = [thing.name] if series else list(thing.columns)
+        for label, column_dtype in zip(labels, dtypes):
+            if (not isinstance(column_dtype, numpy.dtype)
+                    or column_dtype.kind not in "biuf"):
+                raise ValueError(
+                    "Only numeric columns can be memory-mapped "
+                    "('{}' is {})".format(label, column_dtype))
+        if series:
+            dtype = thing.dtype
+            columns = None
+        else:
+            dtype = numpy.result_type(*dtypes)
+            columns = [str(column) for column in thing.columns]
+        numpy.save(Helpers.mapped_target_string.format(name),
+                   numpy.asfortranarray(thing.values.astype(dtype,
+                                                            copy=False)))
+        numpy.save(Helpers.mapped_index_string.format(name),
+                   thing.index.values)
+        with open(Helpers.mapped_metadata_string.format(name), "w") as writer:
+            json.dump(dict(series=series,
+                           name=str(thing.name) if series else None,
+                           columns=columns,
+                           dtypes=[column_dtype.str for column_dtype in dtypes]),
+                      writer)
+        return
+
+    @staticmethod
+    def unmap(name):
+        """memory-maps the saved data without copying it
+
+        The data is read-only, pages are loaded as they are used and are
+        shared with any other process that maps the same file. Columns that
+        were stored as another dtype are cast back to their own (those are
+        copies).
+
+        Args:
+         name: name of the file without the folder or extension
+
+        Returns:
+         pandas.DataFrame or pandas.Series: what was saved
+        """
+        with open(Helpers.mapped_metadata_string.format(name)) as reader:
+            metadata = json.load(reader)
+        values = numpy.load(Helpers.mapped_target_string.format(name),
+                            mmap_mode="r")
+        index = numpy.load(Helpers.mapped_index_string.format(name),
+                           mmap_mode="r")
+        if metadata["series"]:
+            return pandas.Series(values, index=index, name=metadata["name"],
+                                 copy=False)
+        dtypes = [numpy.dtype(dtype) for dtype in metadata.get(
+            "dtypes", [values.dtype.str] * values.shape[1])]
+        if all(dtype == values.dtype for dtype in dtypes):
+            return pandas.DataFrame(values, index=index,
+                                    columns=metadata["columns"], copy=False)
+        columns = {}
+        for position, (column, dtype) in enumerate(zip(metadata["columns"],
+                                                       dtypes)):
+            columns[column] = values[:, position].astype(dtype, copy=False)
+        return pandas.DataFrame(columns, index=index, copy=False)
+
+    @staticmethod
+    def mapped_exists(name):
+        """checks if the thing is already a memory-mappable file
+
+        Args:
+         name: name of the file without folder or extension
+
+        Returns:
+         bool: True if the numpy file exists
+        """
+        return os.path.isfile(Helpers.mapped_target_string.format(name))
+
 
 class DataSource:
     """Strings for the files
@@ -162,3 +338,59 @@ class DataKeys:
     day = "day"
     month = "month"
     year = "year"
+    shop_name = "shop_name"
+    category_name = "item_category_name"
+    id = "ID"
+    submission_count = "item_cnt_month"
+
+
+class DataTypes:
+    """The compact dtypes for the columns (keyed by the DataKeys)
+
+    The ids all fit in small integers (there are 60 shops, 84 categories,
+    34 months and about 22,000 items) and the names and dates repeat a lot
+    so they're stored as categoricals.
+    """
+    columns = {
+        DataKeys.id: "int32",
+        DataKeys.date: "category",
+        DataKeys.date_block: "int8",
+        DataKeys.shop: "int8",
+        DataKeys.item: "int16",
+        DataKeys.item_category: "int8",
+        DataKeys.price: "float32",
+        DataKeys.day_count: "float32",
+        DataKeys.month_count: "float32",
+        DataKeys.submission_count: "float32",
+        DataKeys.name: "category",
+        DataKeys.shop_name: "category",
+        DataKeys.category_name: "category",
+    }
+
+    @staticmethod
+    def convert(frame):
+        """casts the columns that are in the registry to their compact dtypes
+
+        Args:
+         frame: data-frame with some of the DataKeys columns
+
+        Returns:
+         pandas.DataFrame: the frame with the compact dtypes
+        """
+        return frame.astype({column: dtype
+                             for column, dtype in DataTypes.columns.items()
+                             if column in frame.columns})
+
+    @staticmethod
+    def read_csv(path, columns=None):
+        """loads a csv-file with the compact dtypes
+
+        Args:
+         path: path to the (possibly gzipped) csv file
+         columns: the columns to load (all of them if None)
+
+        Returns:
+         pandas.DataFrame: the data
+        """
+        return pandas.read_csv(path, dtype=DataTypes.columns,
+                               usecols=columns)
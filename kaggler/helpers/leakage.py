@@ -0,0 +1,361 @@
+"""Leak features made from the pairs of ids in a pair-matching test set"""
+# python standard library
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+# from pypi
+import numpy
+import pandas
+import scipy.sparse
+import scipy.sparse.csgraph
+
+
+class PairKeys:
+    """Column names for the pairs data"""
+    pair = "pairId"
+    first = "FirstId"
+    second = "SecondId"
+
+
+class GraphKeys:
+    """Column names for the graph features"""
+    first_degree = "first_degree"
+    second_degree = "second_degree"
+    common = "common_neighbours"
+    jaccard = "jaccard"
+    adamic_adar = "adamic_adar"
+    component = "component"
+    component_size = "component_size"
+
+
+class RuleKeys:
+    """Column names and comparisons for the threshold rules"""
+    comparison = "comparison"
+    threshold = "threshold"
+    positives = "positives"
+    rate = "positive_rate"
+    error = "rate_error"
+    accuracy = "best_accuracy"
+    at_least = ">="
+    less_than = "<"
+    equal = "=="
+
+
+def unique_edges(first, second, size=None):
+    """the de-duplicated edges of the undirected graph the pairs make
+
+    Each pair is added in both directions and the (row, column) edges are
+    packed into one int64 (``row * size + column``) so one in-place sort
+    (dropping the repeats like ``numpy.unique`` does) both removes the
+    duplicates and orders the edges by row and then column (the order a
+    CSR matrix needs).
+
+    Args:
+     first: array of the first id of each pair
+     second: array of the second id of each pair
+     size: number of ids (one more than the largest id if None)
+
+    Returns:
+     tuple: rows, columns of the unique edges, size
+
+    Raises:
+     ValueError: the arrays aren't the same length or have negative ids
+    """
+    first = numpy.asarray(first, dtype=numpy.int64)
+    second = numpy.asarray(second, dtype=numpy.int64)
+    if len(first) != len(second):
+        raise ValueError("The id arrays need to be the same length "
+                         "({} != {})".format(len(first), len(second)))
+    if len(first) and min(first.min(), second.min()) < 0:
+        raise ValueError("The ids can't be negative")
+    if size is None:
+        size = int(max(first.max(), second.max())) + 1 if len(first) else 0
+    packed = numpy.concatenate((first * size + second, second * size + first))
+    packed.sort()
+    new = numpy.ones(len(packed), dtype=bool)
+    new[1:] = packed[1:] != packed[:-1]
+    packed = packed[new]
+    return packed // size, packed % size, size
+
+
+def incidence_matrix(first, second, size=None):
+    """the symmetric 0-1 incidence matrix of the pairs
+
+    Since the unique edges come out sorted, the CSR arrays are built
+    directly (the row pointers are the cumulative row counts) instead of
+    going through a COO matrix.
+
+    Args:
+     first: array of the first id of each pair
+     second: array of the second id of each pair
+     size: number of ids (one more than the largest id if None)
+
+    Returns:
+     scipy.sparse.csr_matrix: (size x size) int32 matrix with a 1 for each
+      edge
+    """
+    rows, columns, size = unique_edges(first, second, size)
+    pointers = numpy.zeros(size + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(rows, minlength=size), out=pointers[1:])
+    return scipy.sparse.csr_matrix(
+        (numpy.ones(len(columns), dtype=numpy.int32), columns, pointers),
+        shape=(size, size))
+
+
+def neighbour_keys(matrix, rows):
+    """the (pair, column) keys of the non-zero entries of some rows
+
+    The keys are ``pair * columns + column`` where the pair is the position
+    of the row in ``rows``, so with sorted CSR indices they come out sorted.
+    They're gathered straight from the CSR index arrays (no sliced matrix)
+    and are int32 when they fit (half the memory to sort and search).
+
+    Args:
+     matrix: CSR matrix with sorted indices
+     rows: the row for each pair
+
+    Returns:
+     tuple: keys, positions of the entries in the matrix's data
+    """
+    starts = matrix.indptr[rows]
+    lengths = matrix.indptr[rows + 1] - starts
+    ends = numpy.cumsum(lengths)
+    positions = numpy.repeat(starts - (ends - lengths), lengths)
+    positions += numpy.arange(len(positions), dtype=positions.dtype)
+    dtype = (numpy.int32 if len(rows) * matrix.shape[1] < 2**31
+             else numpy.int64)
+    keys = numpy.repeat(numpy.arange(len(rows), dtype=dtype)
+                        * dtype(matrix.shape[1]), lengths)
+    keys += matrix.indices[positions]
+    return keys, positions
+
+
+def block_similarity(matrix, first, second):
+    """the row dot products for one block of pairs
+
+    Each side's keys are already sorted (and unique), so sorting the two
+    together is a single merge and the columns the two rows share show up
+    as neighbouring equal keys. Only those (few) shared keys are looked up
+    with ``numpy.searchsorted`` to find their entries in the data, so no
+    sort order has to be carried along for all of the keys.
+
+    Args:
+     matrix: CSR matrix with sorted indices and no duplicates
+     first: the first row of each pair
+     second: the second row of each pair
+
+    Returns:
+     numpy.ndarray: the dot product for each pair
+    """
+    first_keys, first_positions = neighbour_keys(matrix, first)
+    second_keys, second_positions = neighbour_keys(matrix, second)
+    keys = numpy.concatenate((first_keys, second_keys))
+    keys.sort(kind="stable")
+    shared = keys[1:][keys[1:] == keys[:-1]]
+    products = (
+        matrix.data[first_positions[numpy.searchsorted(first_keys, shared)]]
+        * matrix.data[second_positions[numpy.searchsorted(second_keys,
+                                                          shared)]])
+    return numpy.bincount(shared // matrix.shape[1],
+                          weights=products,
+                          minlength=len(first)).astype(matrix.dtype)
+
+
+def pair_similarity(matrix, first, second, block_size=2**13, threads=None):
+    """the dot product of the incidence rows of each pair
+
+    For the 0-1 incidence matrix this is the number of ids that both ids in
+    the pair were paired with (the "magic feature"). The pairs are done in
+    blocks of ``block_size`` in a pool of threads which all read the same
+    CSR arrays, so the rows are never copied into sliced matrices and the
+    memory used only grows with the block size.
+
+    Args:
+     matrix: CSR incidence matrix
+     first: array of the first id of each pair
+     second: array of the second id of each pair
+     block_size: how many pairs to do at a time
+     threads: how many threads to use (number of cores if None)
+
+    Returns:
+     numpy.ndarray: the similarity of each pair
+    """
+    if not matrix.has_canonical_format:
+        matrix = matrix.copy()
+        matrix.sum_duplicates()
+    first = numpy.asarray(first, dtype=numpy.int64)
+    second = numpy.asarray(second, dtype=numpy.int64)
+    starts = range(0, len(first), block_size)
+    with ThreadPoolExecutor(threads or os.cpu_count()) as pool:
+        blocks = pool.map(
+            lambda start: block_similarity(
+                matrix, first[start:start + block_size],
+                second[start:start + block_size]),
+            starts)
+        return numpy.concatenate(
+            list(blocks) or [numpy.zeros(0, dtype=matrix.dtype)])
+
+
+def similarity_feature(frame, first=PairKeys.first, second=PairKeys.second):
+    """builds the incidence matrix for the pairs and their similarities
+
+    Args:
+     frame: data-frame with the pairs
+     first: the column with the first ids
+     second: the column with the second ids
+
+    Returns:
+     numpy.ndarray: the similarity of each pair (row)
+    """
+    firsts = frame[first].values
+    seconds = frame[second].values
+    return pair_similarity(incidence_matrix(firsts, seconds), firsts, seconds)
+
+
+def degrees(matrix):
+    """the number of neighbours of each id
+
+    Args:
+     matrix: CSR incidence matrix
+
+    Returns:
+     numpy.ndarray: the degree of each id (row)
+    """
+    return numpy.diff(matrix.indptr)
+
+
+def adamic_adar_matrix(matrix):
+    """the incidence matrix re-weighted so row dot products are Adamic-Adar
+
+    Each entry in column ``c`` becomes the square root of 1/log(degree of
+    c), so the dot product of two rows is the sum of 1/log(degree) over
+    the neighbours they share (neighbours with only one edge get 0 since
+    they can't be shared).
+
+    Args:
+     matrix: CSR incidence matrix
+
+    Returns:
+     scipy.sparse.csr_matrix: float64 matrix with the same structure
+    """
+    counts = degrees(matrix)
+    weights = numpy.zeros(len(counts))
+    many = counts > 1
+    weights[many] = numpy.sqrt(1 / numpy.log(counts[many]))
+    return scipy.sparse.csr_matrix(
+        (weights[matrix.indices], matrix.indices, matrix.indptr),
+        shape=matrix.shape)
+
+
+def graph_features(frame, first=PairKeys.first, second=PairKeys.second,
+                   block_size=2**13, threads=None):
+    """the graph features of each pair from one incidence matrix
+
+    The incidence matrix is built once and everything else comes from its
+    arrays: the degrees from the row pointers, the common neighbours and
+    Adamic-Adar scores from the blocked ``pair_similarity`` (the latter on
+    a re-weighted copy of the data array), Jaccard from the degrees and
+    common neighbours, and the components from
+    ``scipy.sparse.csgraph.connected_components``. Since both ids of a
+    pair are connected, they're always in the same component.
+
+    Args:
+     frame: data-frame with the pairs
+     first: the column with the first ids
+     second: the column with the second ids
+     block_size: how many pairs to do at a time for the similarities
+     threads: how many threads to use (number of cores if None)
+
+    Returns:
+     pandas.DataFrame: the features (same index as the frame)
+    """
+    firsts = frame[first].values.astype(numpy.int64)
+    seconds = frame[second].values.astype(numpy.int64)
+    matrix = incidence_matrix(firsts, seconds)
+    counts = degrees(matrix)
+    common = pair_similarity(matrix, firsts, seconds, block_size, threads)
+    union = counts[firsts] + counts[seconds] - common
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        jaccard = numpy.where(union > 0, common / union, 0)
+    adamic_adar = pair_similarity(adamic_adar_matrix(matrix), firsts,
+                                  seconds, block_size, threads)
+    _, labels = scipy.sparse.csgraph.connected_components(matrix,
+                                                          directed=False)
+    sizes = numpy.bincount(labels)
+    return pandas.DataFrame({
+        GraphKeys.first_degree: counts[firsts],
+        GraphKeys.second_degree: counts[seconds],
+        GraphKeys.common: common,
+        GraphKeys.jaccard: jaccard,
+        GraphKeys.adamic_adar: adamic_adar,
+        GraphKeys.component: labels[firsts],
+        GraphKeys.component_size: sizes[labels[firsts]],
+    }, index=frame.index)
+
+
+def threshold_search(feature, positive_rate, top=5):
+    """scores every threshold rule on a feature against a known positive rate
+
+    The feature is sorted once and the cumulative counts of its unique
+    values give, for every value, how many rows a ``>=``, ``<`` or ``==``
+    rule would call positive. A rule can't be more accurate than one minus
+    the gap between its positive rate and the true one, so the rules are
+    ranked by that gap (no predictions need to be submitted to compare
+    them).
+
+    Args:
+     feature: array with the feature value for each row
+     positive_rate: the known fraction of rows that are positive (e.g.
+      from submitting all ones)
+     top: how many of the best rules to return
+
+    Returns:
+     pandas.DataFrame: the best rules (best first)
+
+    Raises:
+     ValueError: the feature is empty
+    """
+    values = numpy.sort(numpy.asarray(feature))
+    rows = len(values)
+    if not rows:
+        raise ValueError("Can't search an empty feature")
+    starts = numpy.flatnonzero(numpy.concatenate(
+        ([True], values[1:] != values[:-1])))
+    uniques = values[starts]
+    counts = numpy.diff(numpy.append(starts, rows))
+    at_least = rows - starts
+    positives = numpy.concatenate((at_least, rows - at_least, counts))
+    rules = pandas.DataFrame({
+        RuleKeys.comparison: numpy.repeat(
+            [RuleKeys.at_least, RuleKeys.less_than, RuleKeys.equal],
+            len(uniques)),
+        RuleKeys.threshold: numpy.tile(uniques, 3),
+        RuleKeys.positives: positives,
+        RuleKeys.rate: positives / rows,
+    })
+    rules[RuleKeys.error] = (rules[RuleKeys.rate] - positive_rate).abs()
+    rules[RuleKeys.accuracy] = 1 - rules[RuleKeys.error]
+    best = numpy.argsort(rules[RuleKeys.error].values, kind="mergesort")[:top]
+    return rules.iloc[best].reset_index(drop=True)
+
+
+def apply_rule(feature, comparison, threshold):
+    """the 0-1 predictions of a threshold rule
+
+    Args:
+     feature: array with the feature value for each row
+     comparison: one of the ``RuleKeys`` comparisons
+     threshold: the value to compare to
+
+    Returns:
+     numpy.ndarray: int8 predictions
+
+    Raises:
+     ValueError: unknown comparison
+    """
+    comparisons = {RuleKeys.at_least: numpy.greater_equal,
+                   RuleKeys.less_than: numpy.less,
+                   RuleKeys.equal: numpy.equal}
+    if comparison not in comparisons:
+        raise ValueError("Unknown comparison: '{}'".format(comparison))
+    return comparisons[comparison](feature, threshold).astype(numpy.int8)
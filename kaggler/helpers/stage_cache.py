@@ -0,0 +1,220 @@
+"""An on-disk cache for the stages that build the training data
+
+Each stage is stored under a key made from a hash of the files it reads
+and the parameters of the stages that produced it, so a new process can
+load whatever is still valid and only rebuild what changed.
+"""
+# python standard library
+import hashlib
+import os
+import pickle
+
+# from pypi
+import pandas
+
+# this project
+from kaggler.helpers.helpers import Helpers
+
+
+class Digest:
+    """Builds the hashes used as the stage keys"""
+    block_size = 2**20
+    _files = {}
+
+    @staticmethod
+    def file(path):
+        """hashes the contents of a file
+
+        The hash is remembered for the life of the process as long as the
+        file's size and modification time don't change.
+
+        Args:
+         path: path to the file to hash
+
+        Returns:
+         str: hex-digest of the file's bytes
+        """
+        path = os.path.abspath(os.path.expanduser(path))
+        status = os.stat(path)
+        signature = (path, status.st_size, status.st_mtime_ns)
+        if signature not in Digest._files:
+            hasher = hashlib.sha256()
+            with open(path, "rb") as reader:
+                for block in iter(lambda: reader.read(Digest.block_size), b""):
+                    hasher.update(block)
+            Digest._files[signature] = hasher.hexdigest()
+        return Digest._files[signature]
+
+    @staticmethod
+    def parts(*parts):
+        """hashes the representation of the parts
+
+        Args:
+         parts: strings, numbers and tuples of them
+
+        Returns:
+         str: hex-digest of the parts
+        """
+        return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def frame(frame):
+        """hashes the contents of a data-frame
+
+        Args:
+         frame: the data-frame to hash
+
+        Returns:
+         str: hex-digest of the column names and the rows' values
+        """
+        hasher = hashlib.sha256(repr(tuple(frame.columns)).encode("utf-8"))
+        hasher.update(pandas.util.hash_pandas_object(
+            frame, index=False).values.tobytes())
+        return hasher.hexdigest()
+
+
+class StageCache:
+    """Saves and loads stage data keyed on a hash of its inputs
+
+    Args:
+     directory: folder to keep the stage pickles in
+    """
+    extension = ".pkl"
+
+    def __init__(self,
+                 directory=os.path.join(Helpers.pickle_target, "stages")):
+        self._directory = None
+        self.directory = directory
+        return
+
+    @property
+    def directory(self):
+        """The folder with the stage pickles"""
+        return self._directory
+
+    @directory.setter
+    def directory(self, path):
+        """expands the user and saves the path
+
+        Args:
+         path (str): path to the cache folder
+        """
+        self._directory = os.path.expanduser(path)
+        return
+
+    def path(self, name, key):
+        """path to the pickle for a stage
+
+        Args:
+         name: name of the stage
+         key: hash of the stage's inputs
+
+        Returns:
+         str: path to the stage's pickle
+        """
+        return os.path.join(self.directory,
+                            "{}-{}{}".format(name, key, self.extension))
+
+    def exists(self, name, key):
+        """checks if the stage is in the cache
+
+        Args:
+         name: name of the stage
+         key: hash of the stage's inputs
+
+        Returns:
+         bool: True if there's a pickle for the stage
+        """
+        return os.path.isfile(self.path(name, key))
+
+    def load(self, name, key):
+        """loads the stage data
+
+        A missing or unreadable pickle (including one written by another
+        version of pandas or numpy that can't be loaded) is treated as a
+        cache-miss.
+
+        Args:
+         name: name of the stage
+         key: hash of the stage's inputs
+
+        Returns:
+         object: the stage data or None if it isn't cached
+        """
+        if not self.exists(name, key):
+            return None
+        try:
+            with open(self.path(name, key), "rb") as unpickler:
+                return pickle.load(unpickler)
+        except Exception:
+            return None
+
+    def save(self, name, key, data):
+        """pickles the stage data
+
+        The pickle is written to a temporary file first and then moved into
+        place so an interrupted run can't leave a partial stage behind. The
+        pickles it supersedes (see ``clear``) are deleted afterwards so old
+        keys don't pile up.
+
+        Args:
+         name: name of the stage
+         key: hash of the stage's inputs
+         data: the object to store
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(name, key)
+        temporary = "{}.{}.tmp".format(path, os.getpid())
+        with open(temporary, "wb") as pickler:
+            pickle.dump(data, pickler, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+        self.clear(name, keep=key)
+        return
+
+    def fetch(self, name, key, build):
+        """loads the stage or builds and saves it
+
+        Args:
+         name: name of the stage
+         key: hash of the stage's inputs
+         build: callable that creates the data if it isn't cached
+
+        Returns:
+         object: the stage data
+        """
+        data = self.load(name, key)
+        if data is None:
+            data = build()
+            self.save(name, key, data)
+        return data
+
+    def clear(self, name=None, keep=None):
+        """deletes stored stages
+
+        With ``keep`` only the pickles it supersedes are deleted: the ones
+        with the same slot (the part of the key before its last "-", the
+        stage's parameters) and a different key. Keys without a slot
+        don't supersede anything.
+
+        Args:
+         name: stage to delete (all stages if None)
+         keep: key of the stage's pickle to leave in place
+        """
+        if not os.path.isdir(self.directory):
+            return
+        prefix = "" if name is None else "{}-".format(name)
+        kept = None
+        if keep is not None:
+            if "-" not in keep:
+                return
+            prefix = "{}-{}-".format(name, keep.rpartition("-")[0])
+            kept = os.path.basename(self.path(name, keep))
+        for file_name in os.listdir(self.directory):
+            if (file_name.startswith(prefix)
+                    and file_name.endswith(self.extension)
+                    and file_name != kept):
+                try:
+                    os.remove(os.path.join(self.directory, file_name))
+                except FileNotFoundError:
+                    pass
+        return
@@ -124,3 +124,33 @@ specified location."
     (org-macro-replace-all nikola-macro-templates)
     (org-html-export-as-html nil nil t t)
     (write-file outfile nil)))
+
+;; Export functions used by the long-running Emacs daemons.  These don't
+;; visit the files, so a daemon doesn't pile up buffers (or prompt about
+;; files that changed on disk) as it exports post after post.
+(defun nikola-html-export-string (infile)
+  "Return the body only HTML export of INFILE as a string."
+  (with-temp-buffer
+    (insert-file-contents infile)
+    (setq buffer-file-name (expand-file-name infile)
+          default-directory (file-name-directory buffer-file-name))
+    (unwind-protect
+        (progn
+          (org-mode)
+          (org-macro-replace-all nikola-macro-templates)
+          (org-export-as 'html nil nil t))
+      (set-buffer-modified-p nil)
+      (setq buffer-file-name nil))))
+
+(defun nikola-html-export-stdout (infile)
+  "Print the body only HTML export of INFILE to standard output."
+  (let ((coding-system-for-write 'utf-8))
+    (princ (nikola-html-export-string infile))))
+
+(defun nikola-html-export-to (infile outfile)
+  "Export the body only of INFILE to OUTFILE without visiting either."
+  (let ((html (nikola-html-export-string infile))
+        (coding-system-for-write 'utf-8))
+    (with-temp-file outfile
+      (insert html))
+    nil))
@@ -31,10 +31,18 @@ You will need to install emacs and org-mode (v8.x or greater).
 """
 
 from __future__ import unicode_literals
+import configparser
+import hashlib
 import io
+import multiprocessing.util
 import os
 from os.path import abspath, dirname, join
+from queue import Empty, Queue
+import shutil
+import signal
 import subprocess
+import tempfile
+import threading
 
 try:
     from collections import OrderedDict
@@ -51,31 +59,318 @@ except ImportError:
     write_metadata = None  # NOQA
 
 
+PLUGIN_FOLDER = dirname(abspath(__file__))
+INIT_FILE = join(PLUGIN_FOLDER, 'init.el')
+# everything besides the post that changes what emacs exports
+EXPORT_INPUTS = [INIT_FILE, join(PLUGIN_FOLDER, 'conf.el'),
+                 join(PLUGIN_FOLDER, 'macros.org')]
+
+
+def plugin_version():
+    """The version in orgmode.plugin."""
+    parser = configparser.ConfigParser()
+    parser.read(join(PLUGIN_FOLDER, 'orgmode.plugin'))
+    return parser.get('Documentation', 'Version', fallback='')
+
+
+def current_umask():
+    """The process's umask (it can only be read by setting it)."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# read once since setting it isn't safe while the compiles run in threads
+UMASK = current_umask()
+
+
+def scratch_folder():
+    """A memory-backed folder for the servers' exports if there is one."""
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+def write_atomically(path, text):
+    """Write the text to a temporary file next to path and move it there.
+
+    mkstemp makes the file readable only by its owner, so it gets the mode
+    the file at path already has (or the umask's mode for a new file).
+    """
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except OSError:
+        mode = 0o666 & ~UMASK
+    handle, temporary = tempfile.mkstemp(dir=dirname(abspath(path)),
+                                         suffix='.tmp')
+    try:
+        with io.open(handle, 'w', encoding='utf-8') as writer:
+            writer.write(text)
+        os.chmod(temporary, mode)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def lisp_string(text):
+    """Quote text as an emacs-lisp string."""
+    return '"{0}"'.format(text.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+class EmacsDaemons(object):
+    """A pool of long-running Emacs servers that export org files.
+
+    Each server loads init.el (and org) once when it starts, so an export
+    is just an emacsclient call. Servers are handed out one export at a
+    time, so threads that compile at the same time use different servers.
+    A server that doesn't answer within the timeout (seconds, None to wait
+    forever) is killed and not used again.
+    """
+
+    def __init__(self, size, init_file=INIT_FILE, timeout=None):
+        self.init_file = init_file
+        self.timeout = timeout
+        self.names = ['nikola-orgmode-{0}-{1}'.format(os.getpid(), index)
+                      for index in range(size)]
+        self.free = Queue()
+        self.started = []
+        self.pids = {}
+
+    def start(self):
+        """Start all the servers (in parallel) and wait for them."""
+        if shutil.which('emacs') is None or shutil.which('emacsclient') is None:
+            raise OSError('emacs and emacsclient are needed for the servers')
+        processes = [(name, subprocess.Popen(
+            ['emacs', '-q', '--daemon={0}'.format(name),
+             '-l', self.init_file],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+            for name in self.names]
+        for name, process in processes:
+            if process.wait() == 0:
+                self.started.append(name)
+        if len(self.started) < len(self.names):
+            self.stop()
+            raise OSError('Could not start the emacs servers')
+        for name in self.started:
+            self.pids[name] = self.pid(name)
+            self.free.put(name)
+        return self
+
+    def pid(self, name):
+        """The process id of a server (None if it didn't say)."""
+        try:
+            return int(subprocess.check_output(
+                ['emacsclient', '-s', name, '--eval', '(emacs-pid)'],
+                stderr=subprocess.DEVNULL, timeout=self.timeout))
+        except (subprocess.SubprocessError, ValueError):
+            return None
+
+    def take(self):
+        """The next free server (waiting at most the timeout for one)."""
+        try:
+            return self.free.get(timeout=self.timeout)
+        except Empty:
+            raise subprocess.TimeoutExpired('emacsclient', self.timeout)
+
+    def export(self, source):
+        """The HTML export of the org file from the next free server.
+
+        emacsclient can only print the HTML as a lisp string, so the server
+        writes it to a file in memory (/dev/shm if it exists) instead. If
+        the server (or a free one) takes longer than the timeout this
+        raises subprocess.TimeoutExpired.
+        """
+        name = self.take()
+        handle, scratch = tempfile.mkstemp(dir=scratch_folder(), suffix='.html')
+        os.close(handle)
+        try:
+            subprocess.check_call(
+                ['emacsclient', '-s', name, '--eval',
+                 '(nikola-html-export-to {0} {1})'.format(
+                     lisp_string(abspath(source)), lisp_string(scratch))],
+                stdout=subprocess.DEVNULL, timeout=self.timeout)
+            with io.open(scratch, 'r', encoding='utf-8') as reader:
+                return reader.read()
+        except subprocess.TimeoutExpired:
+            # it's stuck (or too slow) so it doesn't get handed out again
+            self.kill(name)
+            name = None
+            raise
+        finally:
+            if name is not None:
+                self.free.put(name)
+            os.unlink(scratch)
+
+    def kill(self, name):
+        """Kill a server that stopped answering."""
+        if name in self.started:
+            self.started.remove(name)
+        pid = self.pids.pop(name, None)
+        if pid is not None:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+    def stop(self):
+        """Shut the servers down."""
+        for name in list(self.started):
+            try:
+                subprocess.call(['emacsclient', '-s', name, '--eval',
+                                 '(kill-emacs)'],
+                                stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL,
+                                timeout=self.timeout)
+            except subprocess.TimeoutExpired:
+                self.kill(name)
+        self.started = []
+
+
+class ExportCache(object):
+    """Emacs exports stored by the hash of everything that goes into them.
+
+    The key is the sha256 of the plugin version, the export configuration
+    (init.el, conf.el and macros.org) and the post's org source, so an
+    unchanged post gets its HTML back without running emacs at all.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._configuration = None
+
+    @property
+    def configuration(self):
+        """The hash of the plugin version and export configuration."""
+        if self._configuration is None:
+            digest = hashlib.sha256(plugin_version().encode('utf-8'))
+            for path in EXPORT_INPUTS:
+                digest.update(path.encode('utf-8'))
+                if os.path.isfile(path):
+                    with io.open(path, 'rb') as reader:
+                        digest.update(reader.read())
+            self._configuration = digest.hexdigest()
+        return self._configuration
+
+    def path(self, source):
+        """Where the export of the source would be stored."""
+        digest = hashlib.sha256(self.configuration.encode('utf-8'))
+        with io.open(source, 'rb') as reader:
+            digest.update(reader.read())
+        return join(self.folder, digest.hexdigest() + '.html')
+
+    def load(self, path):
+        """The stored HTML (None if there isn't any)."""
+        if not os.path.isfile(path):
+            return None
+        with io.open(path, 'r', encoding='utf-8') as reader:
+            return reader.read()
+
+    def save(self, path, html):
+        """Store the HTML (through a temporary file so it's never partial)."""
+        makedirs(self.folder)
+        write_atomically(path, html)
+
+
 class CompileOrgmode(PageCompiler):
     """ Compile org-mode markup into HTML using emacs. """
 
     name = "orgmode"
+    daemons = None
+    daemons_lock = threading.Lock()
+    _cache = None
+
+    @property
+    def cache(self):
+        """The export cache (None if ORGMODE_CACHE is off)."""
+        if not self.site.config.get('ORGMODE_CACHE', True):
+            return None
+        if self._cache is None:
+            self._cache = ExportCache(join(
+                self.site.config.get('CACHE_FOLDER', 'cache'), 'orgmode'))
+        return self._cache
+
+    def get_daemons(self):
+        """The shared pool of emacs servers (None to use emacs --batch).
+
+        The number of servers comes from ORGMODE_DAEMONS in conf.py (one
+        by default since every build process starts its own, 0 turns them
+        off) and how long an export can take from ORGMODE_TIMEOUT. If they
+        can't be started every post is exported with its own emacs --batch
+        instead (always on Windows, where emacs can't run as a named
+        daemon).
+        """
+        size = self.site.config.get('ORGMODE_DAEMONS', 1)
+        if not size or os.name == 'nt':
+            return None
+        with CompileOrgmode.daemons_lock:
+            if CompileOrgmode.daemons is None:
+                try:
+                    CompileOrgmode.daemons = EmacsDaemons(
+                        size, timeout=self.site.config.get('ORGMODE_TIMEOUT',
+                                                           120)).start()
+                    # unlike atexit this also runs when a build worker
+                    # process exits
+                    multiprocessing.util.Finalize(
+                        None, CompileOrgmode.daemons.stop, exitpriority=0)
+                except OSError:
+                    self.logger.warning('Could not start the emacs servers, '
+                                        'using emacs --batch for each post')
+                    CompileOrgmode.daemons = False
+        return CompileOrgmode.daemons or None
+
+    def export(self, source):
+        """The HTML export of the org file (through a server if possible).
+
+        Without a server (or if the server fails or times out) emacs
+        --batch prints the HTML to its stdout.
+        """
+        daemons = self.get_daemons()
+        if daemons is not None and daemons.started:
+            try:
+                return daemons.export(source)
+            except subprocess.CalledProcessError:
+                self.logger.warning('The emacs server could not export {0}, '
+                                    'trying emacs --batch', source)
+            except subprocess.TimeoutExpired:
+                self.logger.warning('The emacs server timed out exporting '
+                                    '{0}, trying emacs --batch', source)
+        command = [
+            'emacs', '--batch',
+            '-l', INIT_FILE,
+            '--eval', '(nikola-html-export-stdout {0})'.format(
+                lisp_string(abspath(source)))
+        ]
+        return subprocess.check_output(command).decode('utf-8')
+
+    def exported(self, source):
+        """The HTML emacs makes for the source (from the cache if possible).
+
+        Only the emacs export is cached, the shortcodes are always applied
+        since what they make can depend on files the cache doesn't know.
+        """
+        cache = self.cache
+        cached = cache.path(source) if cache is not None else None
+        if cached is not None:
+            html = cache.load(cached)
+            if html is not None:
+                return html
+        html = self.export(source)
+        if cached is not None:
+            cache.save(cached, html)
+        return html
 
     def compile(self, source, dest, is_two_file=True, post=None, lang=None):
-        """Compile the source file into HTML and save as dest."""
+        """Compile the source file into HTML and save as dest.
+
+        The HTML stays in memory from the export through the shortcodes,
+        so dest is only written once (atomically).
+        """
         makedirs(os.path.dirname(dest))
         try:
-            command = [
-                'emacs', '--batch',
-                '-l', join(dirname(abspath(__file__)), 'init.el'),
-                '--eval', '(nikola-html-export "{0}" "{1}")'.format(
-                    abspath(source), abspath(dest))
-            ]
-
-            # Dirty walkaround for this plugin to run on Windows platform.
-            if os.name == 'nt':
-                command[5] = command[5].replace("\\", "\\\\")
-
-            subprocess.check_call(command)
-            with io.open(dest, 'r', encoding='utf-8') as inf:
-                output, shortcode_deps = self.site.apply_shortcodes(inf.read())
-            with io.open(dest, 'w', encoding='utf-8') as outf:
-                outf.write(output)
+            output, shortcode_deps = self.site.apply_shortcodes(
+                self.exported(source))
+            write_atomically(dest, output)
             if post is None:
                 if shortcode_deps:
                     self.logger.error(
@@ -1,27 +1,222 @@
 import requests
+import hashlib
 import json
+import threading
+import time
 import numpy as np
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+def canonical_array(x):
+    '''
+       Flattens the answer into a contiguous little-endian float64 array
+       with one bit-pattern for NaN and for zero (so -0.0 == 0.0)
+    '''
+    array = np.array(x, dtype='<f8', order='C').ravel()
+    array[np.isnan(array)] = np.nan
+    array += 0.0
+    return array
 
 def array_to_hash(x):
-    x_tupled = None
-    if type(x) == list:
-        x_tupled = tuple(x)
-    elif type(x) == np.ndarray:
-        x_tupled = tuple(list(x.flatten()))
-    elif type(x) == tuple:
-        x_tupled = x
-    else:
+    '''
+       Fingerprints the values by hashing their raw float64 bytes,
+       which gives the same digest in every run (without making a
+       python float for each element)
+    '''
+    if type(x) not in (list, tuple, np.ndarray):
         raise RuntimeError('unexpected type of input: {}'.format(type(x)))
-    return hash(tuple(map(float, x_tupled)))
+    return hashlib.blake2b(canonical_array(x).data, digest_size=16).hexdigest()
 
 def almostEqual(x, y):
     return abs(x - y) < 1e-3
 
 
+class RequestsTransport(object):
+    '''
+       Posts submissions over a pooled (keep-alive) session and retries
+       connection errors, timeouts and server errors with exponential
+       backoff
+    '''
+    retry_statuses = (429, 500, 502, 503, 504)
+
+    def __init__(self, retries=3, backoff=0.5, pool_size=10, timeout=30):
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                                pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def post(self, url, submission):
+        '''
+           Returns the status code and the decoded json response
+        '''
+        for attempt in range(self.retries + 1):
+            last_try = attempt == self.retries
+            try:
+                request = self.session.post(url, data=json.dumps(submission),
+                                            timeout=self.timeout)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout):
+                if last_try:
+                    raise
+            else:
+                if request.status_code not in self.retry_statuses or last_try:
+                    return request.status_code, request.json()
+            time.sleep(self.backoff * 2**attempt)
+
+
+class LocalGradingServer(object):
+    '''
+       Stand-in for the grading endpoint that checks the submissions
+       against known answers (part: output) on this machine
+
+       Use it as a context manager and point the grader's
+       submission_page at its url
+    '''
+    def __init__(self, assignment_key, parts, expected, host='127.0.0.1',
+                 port=0):
+        self.assignment_key = assignment_key
+        self.parts = parts
+        self.expected = expected
+        handler = type('Handler', (GradingHandler,), dict(grader=self))
+        self.server = ThreadingGradingServer((host, port), handler)
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://{}:{}/'.format(host, port)
+
+    def grade(self, submission):
+        '''
+           Returns the status code and response for a submission
+           (a 400 for anything that isn't shaped like one)
+        '''
+        if not isinstance(submission, dict):
+            return 400, {"details": {
+                "learnerMessage": "The submission isn't a json object"}}
+        if submission.get("assignmentKey") != self.assignment_key:
+            return 400, {"details": {"learnerMessage": "Unknown assignment key"}}
+        parts = submission.get("parts")
+        if not isinstance(parts, dict) or not all(
+                isinstance(answer, dict) for answer in parts.values()):
+            return 400, {"details": {"learnerMessage":
+                "The parts have to be an object of part: {\"output\": ...}"}}
+        unknown = set(parts) - set(self.parts)
+        if unknown:
+            return 400, {"details": {"learnerMessage": "Unknown parts: {}".format(
+                ", ".join(sorted(unknown)))}}
+        results = {}
+        for part, answer in parts.items():
+            if "output" not in answer:
+                continue
+            results[part] = {"correct": answer_matches(
+                answer["output"], self.expected.get(part))}
+        return 201, {"parts": results}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exception):
+        self.stop()
+
+
+class ThreadingGradingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class GradingHandler(BaseHTTPRequestHandler):
+    grader = None
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            submission = json.loads(self.rfile.read(length).decode('utf-8'))
+            status_code, response = self.grader.grade(submission)
+        except ValueError:
+            status_code, response = 400, {"details": {
+                "learnerMessage": "The submission isn't valid json"}}
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *arguments):
+        pass
+
+
+def answer_matches(output, expected):
+    '''
+       Compares the submitted output to the expected answer as numbers
+       when they both are numbers and as strings otherwise
+    '''
+    if expected is None:
+        return False
+    try:
+        return almostEqual(float(output), float(expected))
+    except (TypeError, ValueError, OverflowError):
+        return str(output) == str(expected)
+
+
+class SubmissionQueue(object):
+    '''
+       Sends candidate answers (dicts of part: output) in the
+       background, several at a time over the grader's transport
+
+       put returns a future with the (status code, response) of
+       the candidate's submission
+    '''
+    def __init__(self, grader, email, token, workers=8):
+        self.grader = grader
+        self.email = email
+        self.token = token
+        self.pool = ThreadPoolExecutor(workers)
+
+    def put(self, answers):
+        submission = self.grader.build_submission(self.email, self.token,
+                                                  answers)
+        return self.pool.submit(self.grader.transport.post,
+                                self.grader.submission_page, submission)
+
+    def map(self, candidates):
+        '''
+           Submits all the candidates and returns their results in order
+        '''
+        futures = [self.put(answers) for answers in candidates]
+        return [future.result() for future in futures]
+
+    def close(self):
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+
 class Grader(object):
-    def __init__(self):
-        self.submission_page = 'https://www.coursera.org/api/onDemandProgrammingScriptSubmissions.v1'
+    def __init__(self, transport=None, submission_page=None):
+        self.transport = transport if transport is not None else RequestsTransport()
+        self.submission_page = submission_page or 'https://www.coursera.org/api/onDemandProgrammingScriptSubmissions.v1'
         self.assignment_key = 'S1UqVXp-EeelpgpYPAO2Og'
         self.parts = OrderedDict([
                     ('edAEq', 'max_revenue'),
@@ -41,26 +236,35 @@ class Grader(object):
             output = output.item(0)
         return output
 
-    def submit(self, email, token):
+    def build_submission(self, email, token, answers=None):
+        '''
+           The submission payload for the answers (the stored ones
+           if none are given)
+        '''
+        answers = self.answers if answers is None else answers
         submission = {
                     "assignmentKey": self.assignment_key, 
                     "submitterEmail": email, 
                     "secret": token, 
                     "parts": {}
                   }
-        for part, output in self.answers.items():
+        for part in self.parts:
+            output = answers.get(part)
             if output is not None:
                 submission["parts"][part] = {"output": output}
             else:
                 submission["parts"][part] = dict()
-        request = requests.post(self.submission_page, data=json.dumps(submission))
-        response = request.json()
-        if request.status_code == 201:
+        return submission
+
+    def submit(self, email, token):
+        status_code, response = self.transport.post(
+            self.submission_page, self.build_submission(email, token))
+        if status_code == 201:
             print('Submitted to Coursera platform. See results on assignment page!')
         elif u'details' in response and u'learnerMessage' in response[u'details']:
             print(response[u'details'][u'learnerMessage'])
         else:
-            print("Unknown response from Coursera: {}".format(request.status_code))
+            print("Unknown response from Coursera: {}".format(status_code))
             print(response)
 
     def status(self):